@@ -0,0 +1,183 @@
+import asyncio
+import collections
+import logging
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.filters import StateFilter
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+import database as db
+import tenants
+from config import (ANALYTICS_BUFFER_SIZE, ANALYTICS_FLUSH_INTERVAL, ANALYTICS_RETENTION_DAYS,
+                    ANALYTICS_ROLLUP_INTERVAL)
+
+# Виды событий: нажатие кнопки или команда, переход в состояние FSM, лид в базе, заявка на услугу
+CLICK = "click"
+STATE = "state"
+LEAD = "lead"
+REQUEST = "request"
+
+# Сколько событий в буфере бота запускают запись, не дожидаясь ANALYTICS_FLUSH_INTERVAL
+FLUSH_BATCH_SIZE = 500
+# Имя события обрезается: в нём текст кнопки или callback_data
+NAME_MAX_LENGTH = 64
+# События, записанные позже ANALYTICS_FLUSH_INTERVAL, всё равно попадут в сводку: последний час пересчитывается
+ROLLUP_LAG = 3600
+
+# Воронки для администратора: шаги (подпись, вид события, имя; None — любое имя этого вида)
+FUNNELS: Dict[str, List[Tuple[str, str, Optional[str]]]] = {
+    "Расчёт доставки": [
+        ("Груз", STATE, "CalculationStates:waiting_cargo_name"),
+        ("Объём", STATE, "CalculationStates:waiting_cargo_volume"),
+        ("Вес", STATE, "CalculationStates:waiting_cargo_weight"),
+        ("Заявка", LEAD, "Расчёт доставки"),
+    ],
+    "Услуга": [
+        ("Кнопка", CLICK, "📞 Получить услугу"),
+        ("Имя", STATE, "ServiceStates:waiting_name"),
+        ("Заявка", REQUEST, None),
+    ],
+}
+
+logger = logging.getLogger(__name__)
+
+# Кольцевой буфер событий каждого бота: при переполнении теряются самые старые
+_buffers: Dict[str, Deque[Tuple[int, int, str, str]]] = {}
+_dropped = 0
+_wakeup = asyncio.Event()
+_task: Optional[asyncio.Task] = None
+
+
+def track(user_id: int, kind: str, name: str):
+    """Событие от имени текущего бота; только добавление в буфер, база не трогается"""
+    global _dropped
+    tenant = tenants.current()
+    if ANALYTICS_BUFFER_SIZE <= 0 or user_id == tenant.admin_id:
+        return
+    buffer = _buffers.get(tenant.name)
+    if buffer is None:
+        buffer = _buffers[tenant.name] = collections.deque(maxlen=ANALYTICS_BUFFER_SIZE)
+    if len(buffer) == ANALYTICS_BUFFER_SIZE:
+        _dropped += 1
+    buffer.append((int(time.time()), user_id, kind, name[:NAME_MAX_LENGTH]))
+    if len(buffer) >= FLUSH_BATCH_SIZE:
+        _wakeup.set()
+
+
+async def flush():
+    """Запись накопленных событий всех ботов, по одной пачке на бота"""
+    global _dropped
+    if _dropped:
+        logger.warning("Буфер аналитики переполнен, потеряно событий: %s", _dropped)
+        _dropped = 0
+    for tenant in tenants.all_tenants():
+        buffer = _buffers.get(tenant.name)
+        if not buffer:
+            continue
+        events = list(buffer)
+        buffer.clear()
+        with tenants.activate(tenant):
+            try:
+                await db.add_analytics_events(events)
+            except Exception as e:
+                # Пачка возвращается в начало буфера к следующей записи; что не влезло, теряется, как при переполнении
+                kept = events[max(len(events) - (buffer.maxlen - len(buffer)), 0):]
+                _dropped += len(events) - len(kept)
+                buffer.extendleft(reversed(kept))
+                logger.error("Не удалось записать события аналитики бота %s: %s", tenant.name, e)
+
+
+async def rollup():
+    """Сводки по часам и дням в базе каждого бота и удаление старых событий"""
+    now = int(time.time())
+    delete_before = now - ANALYTICS_RETENTION_DAYS * 86400 if ANALYTICS_RETENTION_DAYS > 0 else 0
+    for tenant in tenants.all_tenants():
+        with tenants.activate(tenant):
+            try:
+                await db.rollup_analytics(now - ROLLUP_LAG, delete_before)
+            except Exception as e:
+                logger.error("Ошибка сводки аналитики бота %s: %s", tenant.name, e)
+
+
+async def _run(rollups: bool):
+    next_rollup = time.monotonic()
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), ANALYTICS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await flush()
+        if rollups and time.monotonic() >= next_rollup:
+            await rollup()
+            next_rollup = time.monotonic() + ANALYTICS_ROLLUP_INTERVAL
+
+
+def start(rollups: bool = True):
+    """Фоновая запись событий; сводки считает только один процесс"""
+    global _task
+    if ANALYTICS_BUFFER_SIZE > 0 and _task is None:
+        _task = asyncio.create_task(_run(rollups))
+
+
+async def stop():
+    """Остановка с записью оставшихся событий; вызывать до закрытия баз"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    await flush()
+
+
+async def get_funnels(days: int = 7) -> Dict[str, List[Tuple[str, int]]]:
+    """Пользователи на каждом шаге воронок за days дней по дневным сводкам текущего бота.
+
+    Пользователи суммируются по дням: вернувшийся на следующий день считается ещё раз
+    """
+    totals = await db.get_analytics_daily(days)
+    funnels = {}
+    for title, steps in FUNNELS.items():
+        funnels[title] = [
+            (label, sum(users for (event_kind, event_name), (_, users) in totals.items()
+                        if event_kind == kind and (name is None or event_name == name)))
+            for label, kind, name in steps
+        ]
+    return funnels
+
+
+async def get_top_clicks(hours: int = 24, limit: int = 10) -> List[Tuple[str, int]]:
+    """Самые частые нажатия за последние hours часов по часовым сводкам"""
+    return await db.get_analytics_top(CLICK, int(time.time()) - hours * 3600, limit)
+
+
+def _is_input_handler(handler: Optional[HandlerObject]) -> bool:
+    """Обработчик ввода в состоянии FSM: текст сообщения — данные пользователя, а не кнопка"""
+    return handler is not None and any(isinstance(item.callback, StateFilter) for item in handler.filters or ())
+
+
+class AnalyticsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: нажатия кнопок и команды, на которые нашёлся обработчик"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not _is_input_handler(data.get("handler")):
+            if isinstance(event, CallbackQuery) and event.data:
+                track(user.id, CLICK, event.data)
+            elif isinstance(event, Message):
+                # Команда — без аргументов, для сообщений без текста (контакт) — тип содержимого
+                name = event.text.split(maxsplit=1)[0] if event.text and event.text.startswith("/") else event.text
+                track(user.id, CLICK, name or event.content_type)
+        return await handler(event, data)
+
+
+def setup(router: Router):
+    if ANALYTICS_BUFFER_SIZE <= 0:
+        return
+    middleware = AnalyticsMiddleware()
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+import metrics
+from cache import MISSING, TTLCache
+from config import (API_CHAT_BURST, API_CHAT_RATE, API_CONNECTIONS, API_KEEPALIVE, API_MAX_RETRIES, API_RATE,
+                    API_RETRY_AFTER_MAX, METRICS_ENABLED)
+
+# Полосы приоритета: меньше — раньше. Ответы пользователям идут без очереди, уведомления администратору — раньше рассылки
+INTERACTIVE = 0
+ADMIN = 1
+BROADCAST = 2
+LANE_NAMES = {INTERACTIVE: "interactive", ADMIN: "admin", BROADCAST: "broadcast"}
+
+# Ограничения Telegram действуют на отправку сообщений; остальные методы (getUpdates, answerCallbackQuery,
+# deleteMessage) идут без очереди
+LIMITED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+UNLIMITED_METHODS = {"SendChatAction"}
+# Сколько чатов помнит ограничитель отправки в один чат
+CHAT_LIMITER_SIZE = 10000
+# Пауза перед повтором после ошибки сервера: 0.5 с, 1 с, 2 с ...
+RETRY_BASE_DELAY = 0.5
+
+logger = logging.getLogger(__name__)
+
+_lane: contextvars.ContextVar[int] = contextvars.ContextVar("api_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def lane(value: int) -> Iterator[int]:
+    """Запросы блока и задачи, созданные внутри, идут в полосе value"""
+    token = _lane.set(value)
+    try:
+        yield value
+    finally:
+        _lane.reset(token)
+
+
+class PriorityLimiter:
+    """Token bucket на бота: токены выдаются по полосе приоритета, внутри полосы — по очереди"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def pause(self, seconds: float):
+        """Остановка отправок бота, например после ответа 429 от Telegram"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def spend(self):
+        """Токен без очереди для ответов пользователям.
+
+        Токены уходят в минус — на столько же дольше ждут уведомления и рассылка. Долг не больше capacity:
+        дальше ответ ждёт, как и после 429, поэтому за любое время бот отправляет не больше rate в секунду
+        плюс два запаса capacity
+        """
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens - 1 >= -self.capacity:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self.capacity - self._tokens) / self.rate)
+
+    async def acquire(self, priority: int):
+        now = time.monotonic()
+        if not self._waiters and now >= self._paused_until:
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        """Выдача токенов ожидающим, пока очередь не опустеет"""
+        while self._waiters:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            while self._tokens >= 1 and self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                # Запрос мог быть отменён, пока ждал
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
+            if self._waiters:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Token bucket на чат: каждый запрос резервирует токен и ждёт его, порядок внутри чата сохраняется"""
+
+    def __init__(self, rate: float, capacity: int, maxsize: int = CHAT_LIMITER_SIZE):
+        self.rate = rate
+        self.capacity = capacity
+        # Через минуту после последней отправки ведро уже полное и запись ничего не ограничивает
+        self._buckets = TTLCache(maxsize, 60.0 + capacity / rate)
+
+    def reserve(self, key: Hashable) -> float:
+        """Сколько секунд ждать до отправки"""
+        now = time.monotonic()
+        state = self._buckets.get(key, count=False)
+        tokens = self.capacity if state is MISSING else min(self.capacity, state[0] + (now - state[1]) * self.rate)
+        tokens -= 1
+        self._buckets.set(key, (tokens, now))
+        return max(0.0, -tokens / self.rate)
+
+
+def _is_limited(name: str) -> bool:
+    return name.startswith(LIMITED_PREFIXES) and name not in UNLIMITED_METHODS
+
+
+class SchedulerMiddleware(BaseRequestMiddleware):
+    """Middleware сессии: очередь отправки с приоритетами, ограничения на бота и на чат, повторы после 429 и 5xx.
+
+    Ответы пользователям (INTERACTIVE) не стоят в очереди: они расходуют токены бота в долг (см. PriorityLimiter.spend),
+    и остальные полосы ждут дольше; ограничение на чат к ним не применяется
+    """
+
+    def __init__(self, rate: float = API_RATE, chat_rate: float = API_CHAT_RATE, chat_burst: int = API_CHAT_BURST,
+                 max_retries: int = API_MAX_RETRIES, retry_after_max: float = API_RETRY_AFTER_MAX):
+        self.rate = rate
+        self.max_retries = max_retries
+        self.retry_after_max = retry_after_max
+        self.chats = ChatLimiter(chat_rate, chat_burst)
+        self._limiters: Dict[int, PriorityLimiter] = {}
+
+    def limiter(self, bot: Bot) -> PriorityLimiter:
+        limiter = self._limiters.get(bot.id)
+        if limiter is None:
+            limiter = self._limiters[bot.id] = PriorityLimiter(self.rate)
+        return limiter
+
+    async def _wait_turn(self, bot: Bot, chat_id: Optional[Hashable], priority: int):
+        start = time.perf_counter()
+        if priority == INTERACTIVE:
+            # Ответ пользователю, который только что написал, не ждёт ни очереди, ни ограничения на чат
+            await self.limiter(bot).spend()
+        else:
+            if chat_id is not None:
+                delay = self.chats.reserve((bot.id, chat_id))
+                if delay:
+                    await asyncio.sleep(delay)
+            await self.limiter(bot).acquire(priority)
+        if METRICS_ENABLED:
+            metrics.API_WAIT_SECONDS.observe(time.perf_counter() - start, LANE_NAMES[priority])
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        name = type(method).__name__
+        if name == "GetUpdates":
+            return await make_request(bot, method)
+
+        limited = _is_limited(name)
+        chat_id = getattr(method, "chat_id", None) if limited else None
+        priority = _lane.get()
+        for attempt in itertools.count():
+            if limited:
+                await self._wait_turn(bot, chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                # Флуд-контроль действует на весь бот — приостанавливаем все его отправки
+                self.limiter(bot).pause(e.retry_after)
+                # Рассылке некуда спешить — она ждёт флуд-контроль любой длины; ответ через минуту уже не нужен
+                if attempt >= self.max_retries or (e.retry_after > self.retry_after_max and priority != BROADCAST):
+                    raise
+                logger.warning("%s: 429, повтор через %s с", name, e.retry_after)
+                if not limited:
+                    await asyncio.sleep(e.retry_after)
+                error = e
+            except (TelegramServerError, TelegramNetworkError) as e:
+                # После таймаута сообщение могло уже уйти — повтор отправил бы его второй раз
+                if attempt >= self.max_retries or "timeout" in e.message.lower():
+                    raise
+                delay = RETRY_BASE_DELAY * 2 ** attempt
+                logger.warning("%s: %s, повтор через %.1f с", name, e.message, delay)
+                await asyncio.sleep(delay)
+                error = e
+            if METRICS_ENABLED:
+                metrics.API_RETRIES.inc(name, type(error).__name__)
+
+
+class SchedulingSession(AiohttpSession):
+    """Сессия Bot API с пулом keep-alive соединений и очередью отправки; одна на все боты процесса"""
+
+    def __init__(self, connections: int = API_CONNECTIONS, keepalive: float = API_KEEPALIVE, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init.update(
+            limit=connections,
+            # Все запросы идут на один хост Bot API
+            limit_per_host=connections,
+            keepalive_timeout=keepalive,
+            ttl_dns_cache=300,
+        )
+        self.scheduler = SchedulerMiddleware()
+        self.middleware(self.scheduler)
@@ -0,0 +1,241 @@
+"""Нагрузочный микробенчмарк database.py: операции в секунду, хвосты задержек и блокировки SQLite.
+
+Запуск из корня проекта:
+    python benchmarks/bench_database.py --users 1000,100000 --concurrency 1,16,64
+
+Для каждого размера базы создаётся временная база с нужным числом пользователей, затем
+для каждой комбинации параллельности и операции (add_user, is_contact_shared,
+update_user_contact, add_lead, get_all_users) выполняется --ops вызовов. Результат —
+по одной JSON-строке на прогон, их удобно сравнивать между настройками:
+    python benchmarks/bench_database.py --journal-mode DELETE --synchronous FULL > delete.jsonl
+    python benchmarks/bench_database.py --processes 4 > wal-4proc.jsonl
+
+Записи выполняются с wait=True, то есть время включает коммит очереди записи.
+Кэш пользователей по умолчанию выключен (--user-cache 0), чтобы чтения доходили до SQLite.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+import db_pool  # noqa: E402
+
+OPERATIONS = ["is_contact_shared", "add_user", "update_user_contact", "add_lead", "get_all_users"]
+
+# Сдвиг новых user_id для add_user, чтобы процессы не пересекались
+NEW_USER_ID_STEP = 100_000_000
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def configure(path: str, settings: Dict[str, Any]):
+    """Настройки соединений и очереди записи из аргументов командной строки"""
+    db.DATABASE_PATH = path
+    db_pool.PRAGMAS = tuple(
+        pragma for pragma in db_pool.PRAGMAS
+        if not pragma.startswith(("PRAGMA journal_mode", "PRAGMA synchronous", "PRAGMA busy_timeout"))
+    ) + (
+        f"PRAGMA journal_mode = {settings['journal_mode']}",
+        f"PRAGMA synchronous = {settings['synchronous']}",
+        f"PRAGMA busy_timeout = {settings['busy_timeout']}",
+    )
+    db.DB_READ_POOL_SIZE = settings["readers"]
+    db.user_cache.maxsize = settings["user_cache"]
+    db.write_queue.max_delay = settings["batch_delay"]
+
+
+def seed(path: str, users: int, settings: Dict[str, Any]):
+    """Схема через init_db и пользователи с лидами одной транзакцией"""
+    configure(path, settings)
+
+    async def create_schema():
+        await db.init_db()
+        await db.close_db()
+
+    asyncio.run(create_schema())
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, phone_number, contact_shared) VALUES (?, ?, ?, ?, ?)",
+            ((user_id, f"user{user_id}", f"User {user_id}",
+              f"+7999{user_id:07d}" if user_id % 3 == 0 else None, user_id % 3 == 0)
+             for user_id in range(1, users + 1)),
+        )
+        rng = random.Random(0)
+        conn.executemany(
+            "INSERT INTO leads (user_id, service_name) VALUES (?, ?)",
+            ((rng.randint(1, users), "Расчёт доставки") for _ in range(max(users // 10, 1))),
+        )
+    conn.close()
+
+
+async def _run(path: str, settings: Dict[str, Any], operation: str, users: int, concurrency: int,
+               ops: int, process_index: int) -> Dict[str, Any]:
+    configure(path, settings)
+    # Схема уже создана; с малым busy_timeout проверка схемы может упереться в блокировку
+    # соседнего процесса, тогда пробуем ещё раз
+    for attempt in itertools.count():
+        try:
+            await db.init_db()
+            break
+        except sqlite3.OperationalError as e:
+            # Незакрытые соединения aiosqlite не дают процессу завершиться
+            await db.close_db()
+            if "locked" not in str(e) or attempt >= 100:
+                raise
+            await asyncio.sleep(0.01)
+
+    rng = random.Random(process_index)
+    new_ids = itertools.count(users + 1 + process_index * NEW_USER_ID_STEP)
+
+    async def call():
+        if operation == "is_contact_shared":
+            await db.is_contact_shared(rng.randint(1, users))
+        elif operation == "add_user":
+            await db.add_user(next(new_ids), "bench", "Bench", None, wait=True)
+        elif operation == "update_user_contact":
+            user_id = rng.randint(1, users)
+            await db.update_user_contact(user_id, f"+7999{user_id:07d}", wait=True)
+        elif operation == "add_lead":
+            await db.add_lead(rng.randint(1, users), "Расчёт доставки", wait=True,
+                              cargo_name="Электроника", cargo_volume="2 м3", cargo_weight="150 кг")
+        elif operation == "get_all_users":
+            await db.get_all_users()
+
+    latencies: List[float] = []
+    errors = {"locked": 0, "other": 0}
+    remaining = itertools.count()
+
+    async def worker():
+        while next(remaining) < ops:
+            start = time.perf_counter()
+            try:
+                await call()
+            except sqlite3.OperationalError as e:
+                errors["locked" if "locked" in str(e) else "other"] += 1
+                continue
+            except Exception:
+                errors["other"] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        elapsed = time.perf_counter() - start
+        await db.close_db()
+    return {"latencies": latencies, "seconds": elapsed, **errors}
+
+
+def run_process(*args) -> Dict[str, Any]:
+    return asyncio.run(_run(*args))
+
+
+def run_case(path: str, settings: Dict[str, Any], operation: str, users: int, concurrency: int,
+             ops: int, processes: int) -> Dict[str, Any]:
+    """Один прогон: ops вызовов на каждый процесс с concurrency корутинами в каждом"""
+    # Каждый прогон в свежих процессах (spawn): у них свои соединения, как у воркеров webhook,
+    # и не остаётся состояния пула и очереди записи от предыдущего прогона
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=context) as executor:
+        futures = [
+            executor.submit(run_process, path, settings, operation, users, concurrency, ops, index)
+            for index in range(processes)
+        ]
+        results = [future.result() for future in futures]
+
+    latencies = [value for result in results for value in result["latencies"]]
+    seconds = max(result["seconds"] for result in results)
+    return {
+        "operation": operation,
+        "users": users,
+        "concurrency": concurrency,
+        "processes": processes,
+        **{key: settings[key] for key in ("journal_mode", "synchronous", "busy_timeout", "readers",
+                                          "batch_delay", "user_cache")},
+        "ops": len(latencies),
+        "seconds": round(seconds, 3),
+        "ops_per_sec": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0) * 1000, 3),
+        "locked_errors": sum(result["locked"] for result in results),
+        "other_errors": sum(result["other"] for result in results),
+    }
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int_list, default=[1000, 100000],
+                        help="размеры базы через запятую, например 1000,1000000")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 16, 64],
+                        help="число одновременных корутин через запятую")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="операции через запятую")
+    parser.add_argument("--ops", type=int, default=2000, help="вызовов на прогон в каждом процессе")
+    parser.add_argument("--scan-ops", type=int, default=5, help="вызовов get_all_users на прогон")
+    parser.add_argument("--processes", type=int, default=1, help="процессов на одной базе")
+    parser.add_argument("--journal-mode", default="WAL")
+    parser.add_argument("--synchronous", default="NORMAL")
+    parser.add_argument("--busy-timeout", type=int, default=5000, help="мс")
+    parser.add_argument("--readers", type=int, default=db.DB_READ_POOL_SIZE, help="соединений для чтения")
+    parser.add_argument("--batch-delay", type=float, default=db.write_queue.max_delay,
+                        help="ожидание группового коммита, с")
+    parser.add_argument("--user-cache", type=int, default=0, help="размер кэша пользователей")
+    parser.add_argument("--output", help="дописать JSON-строки в файл вместо stdout")
+    args = parser.parse_args()
+
+    settings = {
+        "journal_mode": args.journal_mode,
+        "synchronous": args.synchronous,
+        "busy_timeout": args.busy_timeout,
+        "readers": args.readers,
+        "batch_delay": args.batch_delay,
+        "user_cache": args.user_cache,
+    }
+    operations = [name for name in args.operations.split(",") if name]
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for users in args.users:
+            with tempfile.TemporaryDirectory(prefix="bench-db-") as workdir:
+                path = os.path.join(workdir, "bench.db")
+                print(f"Заполнение базы: {users} пользователей", file=sys.stderr)
+                seed(path, users, settings)
+                for concurrency in args.concurrency:
+                    for operation in operations:
+                        ops = args.scan_ops if operation == "get_all_users" else args.ops
+                        result = run_case(path, settings, operation, users, concurrency, ops, args.processes)
+                        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Сравнение построения клавиатур на каждый апдейт с общими разметками из реестра.
+
+Запуск из корня проекта:
+    python benchmarks/bench_keyboards.py [--number 20000]
+"""
+import argparse
+import contextlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keyboards as kb  # noqa: E402
+import tenants  # noqa: E402
+
+# Набор клавиатур, который обработчики отдают чаще всего
+STATIC = ["main_menu", "services_menu", "back_to_menu", "contact_keyboard", "about_us_inline", "materials_menu"]
+SERVICES = ["Доставка грузов", "Перевод денег", "Выкуп товара", "Фулфилмент"]
+
+
+@contextlib.contextmanager
+def unfrozen():
+    """Строители без заморозки — так обработчики строили клавиатуры до реестра."""
+    freeze = kb._freeze
+    kb._freeze = lambda markup: markup
+    try:
+        yield
+    finally:
+        kb._freeze = freeze
+
+
+def build_every_time():
+    for name in STATIC:
+        build = getattr(kb, f"_build_{name}")
+        # Клавиатуры со ссылками бренда строятся по ссылкам бота
+        build(tenants.DEFAULT.links) if name in kb.TENANT_MARKUPS else build()
+    for service in SERVICES:
+        kb._build_service_action.__wrapped__(tenants.DEFAULT, service)
+
+
+def from_registry():
+    for name in STATIC:
+        getattr(kb, f"get_{name}")()
+    for service in SERVICES:
+        kb.get_service_action(service)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="количество повторов")
+    args = parser.parse_args()
+
+    calls = len(STATIC) + len(SERVICES)
+
+    def measure(func):
+        seconds = min(timeit.repeat(func, number=args.number, repeat=3))
+        return seconds / (args.number * calls) * 1e6
+
+    results = {"frozen": measure(build_every_time), "registry": measure(from_registry)}
+    with unfrozen():
+        results["build"] = measure(build_every_time)
+    for name in ("build", "registry"):
+        print(f"{name:>8}: {results[name]:8.3f} мкс на клавиатуру")
+    # Заморозку платит только первое обращение к реестру, в сравнение она не входит
+    print(f"  freeze: {results['frozen'] - results['build']:8.3f} мкс на клавиатуру (однократно при заполнении реестра)")
+
+    print(f"Экономия CPU: {results['build'] - results['registry']:.3f} мкс на клавиатуру, "
+          f"в {results['build'] / results['registry']:.0f} раз быстрее")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Подставной Bot API для локальной проверки бота без обращения к Telegram.
+
+Запуск из корня проекта:
+    python benchmarks/fake_bot_api.py --port 8081
+
+Бот подключается к нему через BOT_API_SERVER=http://127.0.0.1:8081.
+Сообщение от пользователя доставляется боту так (через getUpdates или на webhook,
+если бот его зарегистрировал):
+    curl -X POST 127.0.0.1:8081/inject -d '{"user_id": 1, "text": "/start"}'
+Вызовы бота можно посмотреть на GET /calls.
+
+Задержка ответов и доля ответов 429 задаются параметрами:
+    python benchmarks/fake_bot_api.py --latency 50 --jitter 20 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAnimation", "sendAudio",
+    "sendVoice", "sendVideoNote", "sendSticker", "sendContact", "sendLocation", "editMessageText",
+}
+
+# Методы, на которые может прийти 429 (отправка сообщений пользователям)
+FLOOD_METHODS = MESSAGE_METHODS | {"copyMessage", "sendMediaGroup"}
+
+# Сколько последних вызовов хранить для GET /calls
+MAX_CALLS = 10000
+
+
+class FakeBotAPI:
+    """Bot API в памяти: отвечает на методы бота и пересылает ему обновления"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        self.calls: collections.deque = collections.deque(maxlen=MAX_CALLS)
+        # Вызываются на каждый вызов метода ботом, например чтобы ждать ответ пользователю
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        # Бот начал получать обновления: первый getUpdates или зарегистрированный webhook
+        self.ready = asyncio.Event()
+        self._pending: collections.deque = collections.deque()
+        self._updates_available = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._session: Optional[ClientSession] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        app.router.add_post("/inject", self.handle_inject)
+        app.router.add_get("/calls", self.handle_calls)
+        app.on_cleanup.append(self._close_session)
+        return app
+
+    async def _close_session(self, app: web.Application):
+        if self._session is not None:
+            await self._session.close()
+
+    # Ответы на методы Bot API
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        if "photo" in params:
+            file_id = f"photo-{next(self._file_ids)}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+        if "document" in params:
+            file_id = f"document-{next(self._file_ids)}"
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        return message
+
+    def call_method(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            self.secret_token = params.get("secret_token")
+            self.ready.set()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [self._message(params) for _ in media]
+        return True
+
+    async def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Long polling: обновления начиная с offset, ожидание до timeout секунд"""
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Обновления до offset бот подтвердил — удаляем их
+        while self._pending and self._pending[0]["update_id"] < offset:
+            self._pending.popleft()
+        self.ready.set()
+        if not self._pending and timeout:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._pending, limit))
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        # Файлы из multipart не храним, достаточно отметки о том, что они были
+        params = {key: value if isinstance(value, str) else "<file>" for key, value in params.items()}
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(params)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if method in FLOOD_METHODS and self.flood_rate and random.random() < self.flood_rate:
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        call = {"method": method, "params": params, "time": time.time()}
+        self.calls.append(call)
+        for listener in self.listeners:
+            listener(call)
+        return web.json_response({"ok": True, "result": self.call_method(method, params)})
+
+    # Обновления для бота
+
+    def make_update(self, user_id: int, text: Optional[str] = None, phone_number: Optional[str] = None,
+                    callback_data: Optional[str] = None) -> Dict[str, Any]:
+        """Обновление от пользователя: текст, контакт или нажатие инлайн-кнопки"""
+        user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+        }
+        update: Dict[str, Any] = {"update_id": next(self._update_ids)}
+        if callback_data is not None:
+            message["from"] = BOT_USER
+            update["callback_query"] = {
+                "id": str(update["update_id"]),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": callback_data,
+                "message": message,
+            }
+            return update
+        if phone_number is not None:
+            message["contact"] = {"phone_number": phone_number, "first_name": user["first_name"], "user_id": user_id}
+        else:
+            message["text"] = text or ""
+        update["message"] = message
+        return update
+
+    async def push(self, update: Dict[str, Any]) -> Optional[int]:
+        """Передача обновления боту: на webhook, если он задан, иначе в очередь getUpdates"""
+        if self.webhook_url:
+            return await self.deliver(update)
+        self._pending.append(update)
+        self._updates_available.set()
+        return None
+
+    async def deliver(self, update: Dict[str, Any]) -> int:
+        """Отправка обновления на зарегистрированный webhook с секретным заголовком"""
+        if not self.webhook_url:
+            raise web.HTTPConflict(text="webhook не зарегистрирован")
+        if self._session is None:
+            self._session = ClientSession()
+        headers = {}
+        if self.secret_token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.secret_token
+        async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+            return response.status
+
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        update = self.make_update(
+            int(data["user_id"]),
+            text=data.get("text"),
+            phone_number=data.get("phone_number"),
+            callback_data=data.get("callback_data"),
+        )
+        status = await self.push(update)
+        return web.json_response({"update_id": update["update_id"], "webhook_status": status})
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        return web.json_response(list(self.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля отправок, на которые придёт 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    args = parser.parse_args()
+    api = FakeBotAPI(args.latency / 1000, args.jitter / 1000, args.flood_rate, args.retry_after)
+    web.run_app(api.build_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
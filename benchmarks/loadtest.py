@@ -0,0 +1,274 @@
+"""Нагрузочный тест бота через подставной Bot API.
+
+Запуск из корня проекта:
+    python benchmarks/loadtest.py --users 1000 --concurrency 200
+
+Скрипт поднимает fake_bot_api.py в своём процессе и запускает main.py в режиме polling
+с базой во временном каталоге. Каждый виртуальный пользователь проходит сценарии
+/start, расчёт доставки (CalculationStates с отправкой контакта) и заявку на услугу,
+затем администратор делает рассылку. Для каждого сценария выводятся пропускная способность
+и p50/p95/p99 времени от отправки сообщения пользователем до ответа бота.
+
+Параметры Bot API (задержка, доля ответов 429) передаются в подставной сервер, настройки
+бота — через переменные окружения, например API_RATE=1000.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+ADMIN_ID = 1000
+FIRST_USER_ID = 100000
+
+
+class StepTimeout(Exception):
+    pass
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class FlowStats:
+    """Время ответов и число успешных и неудачных прохождений одного сценария"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.completed = 0
+        self.errors = 0
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            "flow": self.name,
+            "completed": self.completed,
+            "errors": self.errors,
+            "flows_per_sec": round(self.completed / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(self.latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 1),
+        }
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, reply_timeout: float, think_time: float):
+        self.api = api
+        self.reply_timeout = reply_timeout
+        self.think_time = think_time
+        self.flows: Dict[str, FlowStats] = {}
+        # Ответы бота по chat_id: виртуальный пользователь ждёт их после каждого сообщения
+        self.replies: Dict[int, asyncio.Queue] = {}
+        api.listeners.append(self._on_call)
+
+    def _on_call(self, call: Dict[str, Any]):
+        chat_id = call["params"].get("chat_id")
+        if chat_id is None:
+            return
+        queue = self.replies.get(int(chat_id))
+        if queue is not None:
+            queue.put_nowait((call, time.perf_counter()))
+
+    def flow(self, name: str) -> FlowStats:
+        if name not in self.flows:
+            self.flows[name] = FlowStats(name)
+        return self.flows[name]
+
+    async def step(self, stats: FlowStats, user_id: int, expect: Optional[str] = None,
+                   **update: Any) -> Dict[str, Any]:
+        """Сообщение от пользователя и ожидание первого ответа бота в этот чат (с текстом expect, если задан)"""
+        queue = self.replies.setdefault(user_id, asyncio.Queue())
+        # Лишние сообщения от прошлого шага не должны засчитываться как ответ на этот
+        while not queue.empty():
+            queue.get_nowait()
+        start = time.perf_counter()
+        deadline = start + self.reply_timeout
+        await self.api.push(self.api.make_update(user_id, **update))
+        while True:
+            try:
+                call, replied_at = await asyncio.wait_for(queue.get(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                raise StepTimeout(f"нет ответа пользователю {user_id} на {update}")
+            if expect is None or expect in call["params"].get("text", ""):
+                break
+        stats.latencies.append(replied_at - start)
+        return call
+
+    async def run_flow(self, name: str, user_id: int, steps: List[Dict[str, Any]]):
+        stats = self.flow(name)
+        try:
+            for index, update in enumerate(steps):
+                # Пауза «на ввод»: бот отвечает до того, как сохранит новое состояние FSM,
+                # и мгновенный следующий шаг мог бы обогнать set_state
+                if index:
+                    await asyncio.sleep(self.think_time)
+                await self.step(stats, user_id, **update)
+            stats.completed += 1
+        except StepTimeout:
+            stats.errors += 1
+
+    async def run_user(self, user_id: int):
+        await self.run_flow("start", user_id, [{"text": "/start"}])
+        await self.run_flow("calculation", user_id, [
+            {"text": "📊 Получить расчёт"},
+            {"text": "Электроника"},
+            {"text": "2 м3"},
+            {"text": "150 кг"},
+            {"phone_number": f"+7999{user_id:07d}"},
+        ])
+        # Контакт уже сохранён, поэтому бот сразу спрашивает имя
+        await self.run_flow("service", user_id, [
+            {"text": "📞 Получить услугу"},
+            {"text": f"Пользователь {user_id}"},
+        ])
+
+    async def run_users(self, users: int, concurrency: int) -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(user_id: int):
+            async with semaphore:
+                await self.run_user(user_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(FIRST_USER_ID + index) for index in range(users)))
+        return time.perf_counter() - start
+
+    async def run_broadcast(self, users: int, timeout: float) -> Dict[str, Any]:
+        """Рассылка от администратора: время до завершения и задержка доставки каждому получателю"""
+        delivered: Dict[int, float] = {}
+        finished = asyncio.Event()
+
+        def on_call(call: Dict[str, Any]):
+            params = call["params"]
+            if call["method"] == "copyMessage":
+                delivered.setdefault(int(params["chat_id"]), time.perf_counter())
+            elif call["method"] == "editMessageText" and "завершена" in params.get("text", ""):
+                finished.set()
+
+        stats = FlowStats("broadcast")
+        # Администратору приходят и уведомления о заявках, поэтому ждём конкретные ответы
+        await self.step(stats, ADMIN_ID, expect="Админ-панель", text="/admin")
+        await self.step(stats, ADMIN_ID, expect="Отправьте сообщение", text="📢 Создать рассылку")
+        await asyncio.sleep(self.think_time)
+        self.api.listeners.append(on_call)
+        try:
+            start = time.perf_counter()
+            await self.api.push(self.api.make_update(ADMIN_ID, text="Нагрузочная рассылка"))
+            try:
+                await asyncio.wait_for(finished.wait(), timeout)
+                stats.completed += 1
+            except asyncio.TimeoutError:
+                stats.errors += 1
+            elapsed = time.perf_counter() - start
+        finally:
+            self.api.listeners.remove(on_call)
+
+        latencies = [at - start for at in delivered.values()]
+        return {
+            "flow": "broadcast",
+            "completed": stats.completed,
+            "errors": stats.errors,
+            "recipients": len(delivered),
+            "expected": users,
+            "seconds": round(elapsed, 2),
+            "messages_per_sec": round(len(delivered) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+
+
+async def start_bot(port: int, workdir: str) -> asyncio.subprocess.Process:
+    """Запуск main.py против подставного Bot API с отдельной базой в workdir"""
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:LOADTEST",
+        "ADMIN_ID": str(ADMIN_ID),
+        "BOT_API_SERVER": f"http://127.0.0.1:{port}",
+        "BOT_MODE": "polling",
+    })
+    return await asyncio.create_subprocess_exec(sys.executable, MAIN_PATH, cwd=workdir, env=env)
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    widths = {column: max(len(column), *(len(str(row.get(column, ""))) for row in rows)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(str(row.get(column, "")).ljust(widths[column]) for column in columns))
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    api = FakeBotAPI(args.latency / 1000, args.jitter / 1000, args.flood_rate, args.retry_after)
+    runner = web.AppRunner(api.build_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    bot: Optional[asyncio.subprocess.Process] = None
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    try:
+        if not args.no_spawn:
+            bot = await start_bot(args.port, workdir.name)
+        await asyncio.wait_for(api.ready.wait(), args.startup_timeout)
+
+        test = LoadTest(api, args.reply_timeout, args.think_time / 1000)
+        elapsed = await test.run_users(args.users, args.concurrency)
+        results = [stats.summary(elapsed) for stats in test.flows.values()]
+
+        if args.broadcast:
+            broadcast_timeout = max(args.reply_timeout, args.users / args.broadcast_min_rate)
+            results.append(await test.run_broadcast(args.users, broadcast_timeout))
+        return results
+    finally:
+        if bot is not None and bot.returncode is None:
+            bot.terminate()
+            await bot.wait()
+        await runner.cleanup()
+        workdir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="число виртуальных пользователей")
+    parser.add_argument("--concurrency", type=int, default=200, help="сколько пользователей действуют одновременно")
+    parser.add_argument("--port", type=int, default=8081, help="порт подставного Bot API")
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля отправок, на которые придёт 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--think-time", type=float, default=300, help="пауза пользователя между шагами, мс")
+    parser.add_argument("--reply-timeout", type=float, default=10, help="сколько ждать ответа бота, с")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="сколько ждать запуска бота, с")
+    parser.add_argument("--no-broadcast", dest="broadcast", action="store_false", help="без рассылки")
+    parser.add_argument("--broadcast-min-rate", type=float, default=10,
+                        help="минимальная скорость рассылки (сообщ./с), по ней считается таймаут")
+    parser.add_argument("--no-spawn", action="store_true",
+                        help="не запускать бота: он уже работает с BOT_API_SERVER на этот порт и ADMIN_ID=1000")
+    parser.add_argument("--json", action="store_true", help="вывод в JSON Lines")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        for row in results:
+            print(json.dumps(row, ensure_ascii=False))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import (
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+import api_session
+import database as db
+from config import BROADCAST_WORKERS
+
+# Как часто обновлять сообщение с прогрессом в чате администратора
+PROGRESS_INTERVAL = 5.0
+# Сколько ждать остальные части альбома после первой
+ALBUM_COLLECT_DELAY = 1.0
+# Сколько получателей воркеры забирают из базы за один раз
+CLAIM_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+
+def _input_media(message: Message):
+    caption = dict(caption=message.caption, caption_entities=message.caption_entities, parse_mode=None)
+    if message.photo:
+        return InputMediaPhoto(media=message.photo[-1].file_id, **caption)
+    if message.video:
+        return InputMediaVideo(media=message.video.file_id, **caption)
+    if message.document:
+        return InputMediaDocument(media=message.document.file_id, **caption)
+    if message.audio:
+        return InputMediaAudio(media=message.audio.file_id, **caption)
+    raise ValueError(f"Неподдерживаемый тип сообщения в альбоме: {message.content_type}")
+
+
+class BroadcastPayload:
+    """Содержимое рассылки: одно сообщение любого типа или альбом"""
+
+    def __init__(self, from_chat_id: int, message_ids: List[int], album: Optional[list] = None):
+        self.from_chat_id = from_chat_id
+        self.message_ids = message_ids
+        self.album = album
+
+    @classmethod
+    def from_messages(cls, messages: List[Message]) -> "BroadcastPayload":
+        messages = sorted(messages, key=lambda m: m.message_id)
+        album = [_input_media(m) for m in messages] if len(messages) > 1 else None
+        return cls(messages[0].chat.id, [m.message_id for m in messages], album)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "from_chat_id": self.from_chat_id,
+            "message_ids": self.message_ids,
+            "album": [media.model_dump(mode="json") for media in self.album] if self.album else None,
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> "BroadcastPayload":
+        data = json.loads(data)
+        album = [_MEDIA_TYPES[item["type"]](**item) for item in data["album"]] if data["album"] else None
+        return cls(data["from_chat_id"], data["message_ids"], album)
+
+    async def send(self, bot: Bot, chat_id: int):
+        # copyMessage сохраняет тип, подпись и форматирование любого сообщения;
+        # альбом копируется одним sendMediaGroup, иначе он распадётся на части
+        if self.album:
+            await bot.send_media_group(chat_id, media=self.album)
+        else:
+            await bot.copy_message(chat_id, self.from_chat_id, self.message_ids[0])
+
+
+class BroadcastStats:
+    """Счётчики рассылки для отчёта администратору"""
+
+    def __init__(self, job_id: int, total: int, counts: Optional[Dict[str, int]] = None):
+        counts = counts or {}
+        self.job_id = job_id
+        self.total = total
+        self.sent = counts.get("sent", 0)
+        self.blocked = counts.get("blocked", 0)
+        self.failed = counts.get("failed", 0)
+        # Скорость и ETA считаются только по отправкам текущего запуска
+        self._done_at_start = self.done
+        self.started_at = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        rate = self.rate
+        return (self.total - self.done) / rate if rate > 0 else None
+
+    def add(self, status: str):
+        setattr(self, status, getattr(self, status) + 1)
+
+    def format(self, finished: bool = False) -> str:
+        header = "✅ <b>Рассылка завершена!</b>" if finished else "📤 <b>Рассылка идёт...</b>"
+        text = (f"{header} #{self.job_id}\n\n"
+                f"Отправлено: {self.sent} из {self.total}\n"
+                f"Заблокировали бота: {self.blocked}\n"
+                f"Ошибок: {self.failed}\n"
+                f"⚡ Скорость: {self.rate:.1f} сообщ./с")
+        if not finished and self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            text += f"\n⏱ Осталось: ~{minutes} мин {seconds} с"
+        return text
+
+
+async def _report(bot: Bot, chat_id: int, message_id: int, text: str):
+    try:
+        await bot.edit_message_text(text, chat_id, message_id)
+    except TelegramBadRequest:
+        # Текст не изменился или сообщение удалено — отчёт не критичен
+        pass
+
+
+async def _deliver(bot: Bot, payload: BroadcastPayload, user_id: int) -> Tuple[str, Optional[str]]:
+    """Отправка одному получателю; возвращает статус для журнала доставки и текст ошибки.
+
+    Скорость и повторы после 429 и 5xx обеспечивает полоса BROADCAST сессии (api_session.py)
+    """
+    try:
+        await payload.send(bot, user_id)
+        return "sent", None
+    except TelegramForbiddenError as e:
+        # Пользователь заблокировал бота или удалил аккаунт
+        return "blocked", e.message
+    except TelegramBadRequest as e:
+        return "failed", e.message
+    except Exception as e:
+        logger.error("Ошибка отправки сообщения пользователю %s: %s", user_id, e)
+        return "failed", str(e)
+
+
+async def run_broadcast(bot: Bot, job_id: int, total: int, payload: BroadcastPayload,
+                        report_chat_id: int, workers: int = BROADCAST_WORKERS,
+                        fill_cursor: Optional[int] = None) -> BroadcastStats:
+    """Рассылка несколькими воркерами с отчётом о прогрессе; скорость ограничивает очередь отправки сессии"""
+    stats = BroadcastStats(job_id, total, await db.get_broadcast_job_counts(job_id))
+    queue: asyncio.Queue = asyncio.Queue(maxsize=CLAIM_BATCH_SIZE)
+    recipients_added = asyncio.Event()
+
+    # fill_cursor не None — список получателей ещё не собран: дополняем его пачками
+    # после этого user_id параллельно с отправкой
+    async def filler():
+        async for chunk in db.iter_user_id_chunks(active_only=True, after=fill_cursor):
+            await db.add_broadcast_recipients(job_id, chunk)
+            stats.total += len(chunk)
+            recipients_added.set()
+        await db.finish_broadcast_recipients(job_id)
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            status = "failed"
+            try:
+                status, error = await _deliver(bot, payload, user_id)
+                # Результат записывается сразу, чтобы после перезапуска не отправить повторно
+                await db.set_broadcast_recipient_status(job_id, user_id, status, error)
+            except Exception as e:
+                # Воркер продолжает работу: без него queue.join() не дождётся оставшихся получателей
+                logger.error("Рассылка #%s: ошибка обработки получателя %s: %s", job_id, user_id, e)
+            finally:
+                stats.add(status)
+                queue.task_done()
+
+    async def reporter(message_id: int):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await _report(bot, report_chat_id, message_id, stats.format())
+
+    status_message = await bot.send_message(report_chat_id, stats.format())
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    reporter_task = asyncio.create_task(reporter(status_message.message_id))
+    filler_task = None
+    if fill_cursor is not None:
+        filler_task = asyncio.create_task(filler())
+        tasks.append(filler_task)
+    try:
+        while True:
+            # Отправка начинается с первой пачки, не дожидаясь всего списка получателей
+            recipients_added.clear()
+            filling = filler_task is not None and not filler_task.done()
+            batch = await db.claim_broadcast_recipients(job_id, CLAIM_BATCH_SIZE)
+            if batch:
+                for user_id in batch:
+                    await queue.put(user_id)
+                continue
+            if not filling:
+                break
+            waiter = asyncio.create_task(recipients_added.wait())
+            await asyncio.wait([waiter, filler_task], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+        await queue.join()
+        if filler_task is not None:
+            # Ошибка при сборе списка оставляет задачу незавершённой — она продолжится после перезапуска
+            await filler_task
+    finally:
+        reporter_task.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(reporter_task, *tasks, return_exceptions=True)
+
+    await db.finish_broadcast_job(job_id)
+    await _report(bot, report_chat_id, status_message.message_id, stats.format(finished=True))
+    return stats
+
+
+_running: Set[asyncio.Task] = set()
+
+
+def _start(bot: Bot, job_id: int, total: int, payload: BroadcastPayload, report_chat_id: int,
+           fill_cursor: Optional[int]) -> asyncio.Task:
+    # Рассылка уступает очередь отправки ответам пользователям и уведомлениям администратору
+    with api_session.lane(api_session.BROADCAST):
+        task = asyncio.create_task(run_broadcast(bot, job_id, total, payload, report_chat_id,
+                                                 fill_cursor=fill_cursor))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def start_broadcast(bot: Bot, payload: BroadcastPayload, report_chat_id: int) -> asyncio.Task:
+    """Создание задачи рассылки и запуск в фоне, чтобы обработчик администратора не ждал её окончания"""
+    job_id = await db.create_broadcast_job(payload.to_json(), report_chat_id)
+    return _start(bot, job_id, 0, payload, report_chat_id, fill_cursor=0)
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Продолжение рассылок, прерванных перезапуском бота"""
+    jobs = await db.get_unfinished_broadcast_jobs()
+    for job in jobs:
+        await db.release_broadcast_recipients(job["id"])
+        logger.info("Возобновление рассылки #%s", job["id"])
+        _start(bot, job["id"], job["total"], BroadcastPayload.from_json(job["payload"]), job["report_chat_id"],
+               job["fill_cursor"])
+    return len(jobs)
+
+
+async def stop_broadcasts():
+    """Остановка рассылок перед выключением; незавершённые продолжатся при следующем запуске"""
+    for task in list(_running):
+        task.cancel()
+    await asyncio.gather(*_running, return_exceptions=True)
+
+
+_albums: Dict[str, List[Message]] = {}
+
+
+async def collect_album(message: Message) -> Optional[List[Message]]:
+    """Сбор частей альбома: первая часть ждёт остальные и возвращает весь альбом, остальные — None"""
+    group = _albums.get(message.media_group_id)
+    if group is not None:
+        group.append(message)
+        return None
+
+    _albums[message.media_group_id] = [message]
+    await asyncio.sleep(ALBUM_COLLECT_DELAY)
+    return _albums.pop(message.media_group_id)
@@ -9,10 +9,100 @@ except ImportError:
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))  # ID администратора для рассылки
 
+# Несколько ботов (брендов) в одном процессе: JSON-файл с токенами, администраторами, базами и ссылками
+# каждого бота (см. README). Без него работает один бот с BOT_TOKEN и ADMIN_ID
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Адрес Bot API; для локальной проверки можно указать подставной сервер, например http://127.0.0.1:8081
+BOT_API_SERVER = os.getenv("BOT_API_SERVER", "")
+
+# Webhook: публичный адрес, путь, секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Количество процессов, принимающих запросы на одном порту (SO_REUSEPORT)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+
+# Состояния FSM в базе: через сколько секунд без активности диалог удаляется и размер кэша в памяти.
+# Кэш допустим только в одном процессе, поэтому при нескольких воркерах webhook он выключен
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000" if WEBHOOK_WORKERS <= 1 else "0"))
+
+# Количество соединений SQLite только для чтения
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+
+# Групповой коммит: сколько ждать накопления записей (секунды) и максимум операций в транзакции
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.005"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+
+# Кэш профилей пользователей: максимум записей и время жизни в секундах.
+# Кэш одного процесса не видит изменений от других, поэтому при нескольких воркерах webhook он выключен
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000" if WEBHOOK_WORKERS <= 1 else "0"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Запросы к Bot API: соединений в пуле и сколько секунд держать открытым простаивающее соединение
+API_CONNECTIONS = int(os.getenv("API_CONNECTIONS", "100"))
+API_KEEPALIVE = float(os.getenv("API_KEEPALIVE", "60"))
+# Отправка сообщений: не больше API_RATE в секунду на бота и API_CHAT_RATE в секунду в один чат
+# (до API_CHAT_BURST подряд) для уведомлений администратору и рассылки; уведомления идут раньше рассылки.
+# Ответы пользователям идут без очереди и уменьшают долю API_RATE для остальных; ждут они, только если бот
+# превысил API_RATE больше чем на секунду отправок. Ограничение на чат их не касается
+API_RATE = float(os.getenv("API_RATE", "30"))
+API_CHAT_RATE = float(os.getenv("API_CHAT_RATE", "1"))
+API_CHAT_BURST = int(os.getenv("API_CHAT_BURST", "5"))
+# Повторы запроса после 429 (если Telegram просит подождать не дольше API_RETRY_AFTER_MAX секунд; рассылка ждёт
+# сколько угодно) и ошибок 5xx
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+API_RETRY_AFTER_MAX = float(os.getenv("API_RETRY_AFTER_MAX", "10"))
+
+# Рассылка: параллельные отправки; скорость ограничивает API_RATE, повторы — API_MAX_RETRIES
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+
+# Уведомления администратору: если за ADMIN_DIGEST_WINDOW секунд их набралось ADMIN_DIGEST_THRESHOLD,
+# следующие объединяются в сводки не чаще раза в ADMIN_DIGEST_INTERVAL секунд (0 — всегда по одному)
+ADMIN_DIGEST_THRESHOLD = int(os.getenv("ADMIN_DIGEST_THRESHOLD", "5"))
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", "60"))
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "30"))
+# Как часто отправитель уведомлений проверяет очередь, если о новых записях никто не сообщил. Сообщить может
+# только процесс, где он работает; лиды из остальных воркеров webhook ждут проверки, поэтому при них она чаще
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "30" if WEBHOOK_WORKERS <= 1 else "2"))
+
+# Аналитика: события (нажатия, шаги диалогов, заявки) копятся в кольцевом буфере на ANALYTICS_BUFFER_SIZE
+# событий (0 — выключено) и записываются пачкой раз в ANALYTICS_FLUSH_INTERVAL секунд. Раз в
+# ANALYTICS_ROLLUP_INTERVAL секунд они сводятся по часам и дням; сырые события хранятся ANALYTICS_RETENTION_DAYS дней
+ANALYTICS_BUFFER_SIZE = int(os.getenv("ANALYTICS_BUFFER_SIZE", "10000"))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "5"))
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "300"))
+ANALYTICS_RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", "90"))
+
+# Предзагрузка файлов из files/ в Telegram при старте (file_id сохраняются в базе)
+MEDIA_WARMUP = os.getenv("MEDIA_WARMUP", "0") == "1"
+
+# Защита от флуда: не больше THROTTLE_RATE обновлений от пользователя за THROTTLE_WINDOW секунд
+# (0 — выключено); состояние хранится для THROTTLE_CACHE_SIZE последних пользователей
+THROTTLE_RATE = int(os.getenv("THROTTLE_RATE", "20"))
+THROTTLE_WINDOW = float(os.getenv("THROTTLE_WINDOW", "10"))
+THROTTLE_CACHE_SIZE = int(os.getenv("THROTTLE_CACHE_SIZE", "10000"))
+
+# Сторож цикла событий: если цикл не отвечает дольше LOOP_LAG_THRESHOLD секунд, в лог пишутся стек
+# и обработчик, который его занял (0 — выключено)
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+
+# Метрики в формате Prometheus на локальном HTTP-адресе /metrics.
+# При нескольких воркерах webhook каждый слушает свой порт: METRICS_PORT + номер воркера
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
 # Ссылки и данные
 REVIEWS_CHANNEL = "https://t.me/estasiacars"
 COURSE_POST_LINK = "https://t.me/cnchange/185"
 YANDEX_MAPS_LINK = "https://yandex.ru/maps/org/cn_bridge/37529426458/reviews/?from=mapframe&ll=37.625325%2C55.695281&source=mapframe&tab=reviews&um=constructor%3Ab4c9ca86698ace75ba702643723eee2c41f695b5c08a869315a7e1a26937c4bb&utm_source=mapframe&z=15.4"
+WEBSITE_LINK = "https://cnbridge.ru"
 TELEGRAM = "https://t.me/cnbridgeru"
 INSTARGRAM = "https://www.instagram.com/cn.bridge"
 VK = "https://vk.com/cnbridge"
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Set, Tuple, Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import CallbackQuery, Message
+
+import keyboards as kb
+import media_cache as media
+import tenants
+
+CONTENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content.json")
+
+# Как часто проверять, не изменился ли файл каталога
+RELOAD_CHECK_INTERVAL = 2.0
+
+# Значения, которые можно подставлять в тексты каталога как {REVIEWS_CHANNEL}; у каждого бота свои
+PLACEHOLDERS = tenants.DEFAULT_LINKS
+
+logger = logging.getLogger(__name__)
+
+
+class ContentEntry:
+    """Раздел бота: текст или подпись, картинка из files/, клавиатура и сообщение следом"""
+
+    __slots__ = ("text", "image", "keyboard", "follow_up")
+
+    def __init__(self, text: str, image: Optional[str] = None, keyboard: Optional[str] = None,
+                 follow_up: Optional[dict] = None, placeholders: Dict[str, Any] = PLACEHOLDERS):
+        self.text = text.format_map(placeholders)
+        self.image = image
+        self.keyboard = keyboard
+        self.follow_up = ContentEntry(**follow_up, placeholders=placeholders) if follow_up else None
+        # Проверяем имя клавиатуры при загрузке, а не при первом показе
+        if keyboard:
+            kb.get_markup(keyboard)
+
+    @property
+    def markup(self):
+        return kb.get_markup(self.keyboard) if self.keyboard else None
+
+
+class Catalog:
+    """Каталог разделов из content.json с перезагрузкой при изменении файла"""
+
+    def __init__(self, path: str = CONTENT_PATH, placeholders: Dict[str, Any] = PLACEHOLDERS):
+        self.path = path
+        self.placeholders = placeholders
+        self._sections: Dict[str, Dict[str, ContentEntry]] = {}
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self) -> bool:
+        """Загрузка файла; при ошибке остаётся предыдущая версия каталога"""
+        mtime = os.stat(self.path).st_mtime_ns
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+            sections = {
+                section: {key: ContentEntry(**entry, placeholders=self.placeholders) for key, entry in entries.items()}
+                for section, entries in raw.items()
+            }
+        except Exception as e:
+            if not self._sections:
+                raise
+            # Повторим попытку, когда файл снова изменится
+            self._mtime = mtime
+            logger.error("Не удалось перезагрузить каталог %s: %s", self.path, e)
+            return False
+
+        self._sections = sections
+        self._mtime = mtime
+        logger.info("Каталог контента загружен: %s", self.path)
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def images(self) -> Set[str]:
+        """Картинки всех разделов — для проверки файлов при запуске"""
+        images = set()
+        for entries in self._sections.values():
+            for entry in entries.values():
+                for item in (entry, entry.follow_up):
+                    if item is not None and item.image:
+                        images.add(item.image)
+        return images
+
+    def get(self, section: str, key: Optional[str]) -> Optional[ContentEntry]:
+        self._maybe_reload()
+        return self._sections.get(section, {}).get(key)
+
+
+# Каталоги по файлу и ссылкам: боты с одинаковым контентом используют один каталог
+_catalogs: Dict[Tuple[str, str], Catalog] = {}
+
+
+def get_catalog(tenant: Optional[tenants.Tenant] = None) -> Catalog:
+    """Каталог бота (по умолчанию текущего); загружается при первом обращении"""
+    tenant = tenant or tenants.current()
+    path = tenant.content_path or CONTENT_PATH
+    key = (path, json.dumps(tenant.links, sort_keys=True))
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = _catalogs[key] = Catalog(path, tenant.links)
+    return catalog
+
+
+class CatalogFilter(BaseFilter):
+    """Фильтр одним поиском в словаре: текст кнопки или callback_data → раздел каталога"""
+
+    def __init__(self, section: str):
+        self.section = section
+
+    async def __call__(self, event: Union[Message, CallbackQuery]) -> Union[bool, dict]:
+        key = event.data if isinstance(event, CallbackQuery) else event.text
+        entry = get_catalog().get(self.section, key)
+        if entry is None:
+            return False
+        return {"entry": entry}
+
+
+async def answer(message: Message, entry: ContentEntry):
+    """Показ раздела: фото с подписью или текст, если картинки нет"""
+    if entry.image and media.exists(entry.image):
+        await media.answer_photo(message, entry.image, caption=entry.text, reply_markup=entry.markup)
+    else:
+        await message.answer(entry.text, reply_markup=entry.markup)
+
+    if entry.follow_up:
+        await message.answer(entry.follow_up.text, reply_markup=entry.follow_up.markup)
@@ -1,12 +1,118 @@
-import aiosqlite
 import asyncio
-from typing import List, Optional
+import functools
+import logging
+import sqlite3
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+import tenants
+from cache import MISSING, TTLCache
+from config import DB_READ_POOL_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL
+from db_pool import ConnectionPool, WriteQueue
+from metrics import timed
+
+# База бота по умолчанию; у ботов из TENANTS_FILE свои файлы
 DATABASE_PATH = "bot_database.db"
 
+# Сколько пользователей читать за один запрос при потоковом обходе
+USER_CHUNK_SIZE = 1000
+
+# Пул соединений и очередь записи с групповым коммитом есть у каждого бота (tenants.Tenant);
+# функции ниже берут их у текущего бота. Здесь — те же объекты бота по умолчанию
+pool = tenants.DEFAULT.pool
+write_queue = tenants.DEFAULT.write_queue
+
+# Кэш строк users, общий для всех ботов, по ключу (бот, user_id); None — пользователя нет в базе
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+logger = logging.getLogger(__name__)
+
+def _pool() -> ConnectionPool:
+    return tenants.current().pool
+
+def _write_queue() -> WriteQueue:
+    return tenants.current().write_queue
+
+def _user_key(user_id: int) -> tuple:
+    return (tenants.current().name, user_id)
+
+# Миграции схемы по порядку, номер миграции — её позиция в списке начиная с 1.
+# Номер последней применённой хранится в PRAGMA user_version; новые миграции только дописываются в конец
+MIGRATIONS: List[Tuple[str, ...]] = [
+    # 1. Индексы лидов: лиды пользователя, отчёты по датам и по услугам
+    (
+        "CREATE INDEX IF NOT EXISTS idx_leads_user_id ON leads (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_service_name ON leads (service_name, created_at)",
+    ),
+    # 2. Частичный индекс пользователей с контактом: выборки contact_shared IS TRUE не читают остальных
+    (
+        "CREATE INDEX IF NOT EXISTS idx_users_contact_shared ON users (user_id, is_active) "
+        "WHERE contact_shared IS TRUE",
+    ),
+    # 3. Счётчики статистики по уже накопленным данным; дальше их обновляют триггеры из _init_stats
+    (
+        """
+        INSERT OR REPLACE INTO stats_counters (name, value)
+        SELECT 'users_total', COUNT(*) FROM users
+        UNION ALL SELECT 'users_active', COUNT(*) FROM users WHERE is_active IS TRUE
+        UNION ALL SELECT 'users_contact', COUNT(*) FROM users WHERE contact_shared IS TRUE
+        UNION ALL SELECT 'users_with_leads', COUNT(DISTINCT user_id) FROM leads
+        UNION ALL SELECT 'leads_total', COUNT(*) FROM leads
+        """,
+        """
+        INSERT OR REPLACE INTO stats_leads_by_service (service_name, count)
+        SELECT COALESCE(service_name, ''), COUNT(*) FROM leads GROUP BY COALESCE(service_name, '')
+        """,
+        """
+        INSERT OR REPLACE INTO stats_leads_by_day (day, count)
+        SELECT date(created_at), COUNT(*) FROM leads GROUP BY date(created_at)
+        """,
+    ),
+    # 4. Статистика для планировщика по новым индексам; analysis_limit ограничивает время на большой базе
+    (
+        "PRAGMA analysis_limit = 1000",
+        "ANALYZE",
+    ),
+    # 5. Аналитика: журнал событий только на добавление и его сводки по часам и дням (см. analytics.py)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS analytics_events (
+            id INTEGER PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_analytics_events_created_at ON analytics_events (created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS analytics_hourly (
+            hour INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (hour, kind, name)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (day, kind, name)
+        ) WITHOUT ROWID
+        """,
+    ),
+]
+
 async def init_db():
     """Инициализация базы данных"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    await _pool().open(tenants.current().database_path or DATABASE_PATH, readers=DB_READ_POOL_SIZE)
+
+    async with _pool().writer() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -15,10 +121,11 @@ async def init_db():
                 last_name TEXT,
                 phone_number TEXT,
                 contact_shared BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT TRUE
             )
         """)
-        
+
         await db.execute("""
             CREATE TABLE IF NOT EXISTS leads (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,75 +139,711 @@ async def init_db():
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
         """)
-        
-        await db.commit()
 
-async def add_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
-    """Добавление пользователя в базу данных"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute("""
-            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, username, first_name, last_name))
-        await db.commit()
+            CREATE TABLE IF NOT EXISTS media_cache (
+                path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
-async def update_user_contact(user_id: int, phone_number: str):
-    """Обновление контакта пользователя"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute("""
-            UPDATE users SET phone_number = ?, contact_shared = TRUE
-            WHERE user_id = ?
-        """, (phone_number, user_id))
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                report_chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                fill_cursor INTEGER
+            )
+        """)
+
+        # Статус доставки по каждому получателю: pending, claimed, sent, blocked, failed
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                job_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (job_id, user_id)
+            ) WITHOUT ROWID
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+            ON broadcast_recipients (job_id, status, user_id)
+        """)
+
+        # Очередь уведомлений администратору: лид (lead_id) или готовый текст; статус pending, sent или failed
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS admin_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lead_id INTEGER,
+                text TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                FOREIGN KEY (lead_id) REFERENCES leads (id)
+            )
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_admin_outbox_pending
+            ON admin_outbox (next_attempt_at) WHERE status = 'pending'
+        """)
+
+        # Состояния и данные FSM (aiogram) — переживают перезапуск и общие для всех процессов
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)
+        """)
+
+        # Колонка is_active появилась позже — добавляем её в существующие базы
+        columns = [row[1] for row in await db.execute_fetchall("PRAGMA table_info(users)")]
+        if 'is_active' not in columns:
+            await db.execute("ALTER TABLE users ADD COLUMN is_active BOOLEAN DEFAULT TRUE")
+
+        # fill_cursor — последний user_id, добавленный в получатели; NULL, когда список собран
+        columns = [row[1] for row in await db.execute_fetchall("PRAGMA table_info(broadcast_jobs)")]
+        if 'fill_cursor' not in columns:
+            await db.execute("ALTER TABLE broadcast_jobs ADD COLUMN fill_cursor INTEGER")
+
+        await _init_stats(db)
+        await _migrate(db)
+
+    _write_queue().start()
+
+async def _migrate(db):
+    """Применение новых миграций из MIGRATIONS, каждой в своей транзакции вместе с user_version"""
+    rows = await db.execute_fetchall("PRAGMA user_version")
+    if rows[0][0] >= len(MIGRATIONS):
+        return
+
+    # Фиксируем неявную транзакцию, если она осталась от предыдущих запросов
+    await db.commit()
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: воркеры webhook, запущенные одновременно,
+        # применяют миграции по очереди, и следующий видит уже увеличенный user_version
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = await db.execute_fetchall("PRAGMA user_version")
+            if rows[0][0] < version:
+                for statement in statements:
+                    await db.execute(statement)
+                await db.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            await db.rollback()
+            raise
         await db.commit()
 
+async def _init_stats(db):
+    """Таблицы счётчиков статистики и триггеры, которые обновляют их при каждой записи"""
+    # Итоговые значения: users_total, users_active, users_contact, users_with_leads, leads_total
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_leads_by_service (
+            service_name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_leads_by_day (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_total';
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_active' AND NEW.is_active IS TRUE;
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_contact' AND NEW.contact_shared IS TRUE;
+        END
+    """)
+
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_active AFTER UPDATE OF is_active ON users
+        WHEN (NEW.is_active IS TRUE) != (OLD.is_active IS TRUE)
+        BEGIN
+            UPDATE stats_counters SET value = value + (CASE WHEN NEW.is_active IS TRUE THEN 1 ELSE -1 END)
+            WHERE name = 'users_active';
+        END
+    """)
+
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_contact AFTER UPDATE OF contact_shared ON users
+        WHEN (NEW.contact_shared IS TRUE) != (OLD.contact_shared IS TRUE)
+        BEGIN
+            UPDATE stats_counters SET value = value + (CASE WHEN NEW.contact_shared IS TRUE THEN 1 ELSE -1 END)
+            WHERE name = 'users_contact';
+        END
+    """)
+
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users_total';
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users_active' AND OLD.is_active IS TRUE;
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users_contact' AND OLD.contact_shared IS TRUE;
+        END
+    """)
+
+    # Первый ли это лид пользователя, проверяется по idx_leads_user_id из миграции 1
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_leads_insert AFTER INSERT ON leads
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'leads_total';
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_with_leads'
+                AND NOT EXISTS (SELECT 1 FROM leads WHERE user_id = NEW.user_id AND id != NEW.id);
+            INSERT OR IGNORE INTO stats_leads_by_service (service_name) VALUES (COALESCE(NEW.service_name, ''));
+            UPDATE stats_leads_by_service SET count = count + 1 WHERE service_name = COALESCE(NEW.service_name, '');
+            INSERT OR IGNORE INTO stats_leads_by_day (day) VALUES (date(NEW.created_at));
+            UPDATE stats_leads_by_day SET count = count + 1 WHERE day = date(NEW.created_at);
+        END
+    """)
+
+async def close_db():
+    """Запись накопленных изменений и закрытие соединений с базой данных"""
+    await _write_queue().close()
+    if _pool().is_open:
+        # Обновление статистики планировщика для таблиц, где она устарела
+        try:
+            async with _pool().writer() as db:
+                await db.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
+    await _pool().close()
+
+async def flush_writes():
+    """Ожидание записи всех изменений, поставленных в очередь"""
+    await _write_queue().flush()
+
+# Запросы, общие для отдельных функций записи и save_user_changes
+# Повторный /start означает, что пользователь снова доступен для рассылок
+_INSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, last_name)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET is_active = TRUE
+"""
+_UPDATE_CONTACT_SQL = """
+    UPDATE users SET phone_number = ?, contact_shared = TRUE
+    WHERE user_id = ?
+"""
+_INSERT_LEAD_SQL = """
+    INSERT INTO leads (user_id, service_name, cargo_name, cargo_volume, cargo_weight, delivery_method)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+def _cache_new_user(user_id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str]):
+    # Существующая строка при конфликте не меняется, известна только новая
+    key = _user_key(user_id)
+    if user_cache.get(key, count=False) is None:
+        user_cache.set(key, {
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone_number': None,
+            'contact_shared': False
+        })
+
+def _cache_contact(user_id: int, phone_number: str):
+    key = _user_key(user_id)
+    user = user_cache.get(key, count=False)
+    if user is not MISSING and user is not None:
+        user_cache.set(key, {**user, 'phone_number': phone_number, 'contact_shared': True})
+
+def _lead_params(user_id: int, service_name: str, fields: dict) -> tuple:
+    return (user_id, service_name, fields.get('cargo_name'), fields.get('cargo_volume'),
+            fields.get('cargo_weight'), fields.get('delivery_method'))
+
+def _forget_unsaved_user(key: tuple, future: asyncio.Future):
+    # Без ожидания коммита ошибку записи никто не получит: логируем её и не отдаём из кэша строку, которой нет в базе
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.error("Не удалось сохранить пользователя %s: %s", key[1], future.exception())
+    user_cache.pop(key)
+
+@timed
+async def add_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None,
+                   wait: bool = False):
+    """Добавление пользователя в базу данных (wait=True — дождаться коммита)"""
+    future = _write_queue().submit(_INSERT_USER_SQL, (user_id, username, first_name, last_name))
+    _cache_new_user(user_id, username, first_name, last_name)
+    if wait:
+        await future
+    else:
+        future.add_done_callback(functools.partial(_forget_unsaved_user, _user_key(user_id)))
+
+@timed
+async def update_user_contact(user_id: int, phone_number: str, wait: bool = True):
+    """Обновление контакта пользователя"""
+    future = _write_queue().submit(_UPDATE_CONTACT_SQL, (phone_number, user_id))
+    _cache_contact(user_id, phone_number)
+    if wait:
+        await future
+
+@timed
+async def get_user(user_id: int) -> Optional[dict]:
+    """Строка пользователя из кэша или одним запросом к базе"""
+    key = _user_key(user_id)
+    user = user_cache.get(key)
+    if user is not MISSING:
+        return user
+
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT username, first_name, last_name, phone_number, contact_shared
+            FROM users WHERE user_id = ?
+        """, (user_id,))
+    user = None
+    if rows:
+        result = rows[0]
+        user = {
+            'username': result[0],
+            'first_name': result[1],
+            'last_name': result[2],
+            'phone_number': result[3],
+            'contact_shared': result[4]
+        }
+    user_cache.set(key, user)
+    return user
+
+@timed
 async def is_contact_shared(user_id: int) -> bool:
     """Проверка, поделился ли пользователь контактом"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            SELECT contact_shared FROM users WHERE user_id = ?
-        """, (user_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else False
+    user = await get_user(user_id)
+    return user['contact_shared'] if user else False
 
-async def add_lead(user_id: int, service_name: str, **kwargs):
-    """Добавление лида"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            INSERT INTO leads (user_id, service_name, cargo_name, cargo_volume, cargo_weight, delivery_method)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user_id, service_name, kwargs.get('cargo_name'), kwargs.get('cargo_volume'), 
-              kwargs.get('cargo_weight'), kwargs.get('delivery_method')))
-        await db.commit()
+@timed
+async def add_lead(user_id: int, service_name: str, wait: bool = True, **kwargs):
+    """Добавление лида вместе с уведомлением администратору в одной транзакции"""
+    params = _lead_params(user_id, service_name, kwargs)
+
+    async def insert(db):
+        cursor = await db.execute(_INSERT_LEAD_SQL, params)
+        await db.execute("INSERT INTO admin_outbox (lead_id) VALUES (?)", (cursor.lastrowid,))
+
+    future = _write_queue().submit(insert)
+    if wait:
+        await future
+
+@timed
+async def save_user_changes(user_id: int, profile: Optional[Tuple[Optional[str], Optional[str], Optional[str]]],
+                            phone_number: Optional[str], leads: List[Tuple[str, dict, str]],
+                            notifications: List[str], wait: bool = True):
+    """Все изменения пользователя за одно обновление одной операцией очереди записи.
+
+    profile — (username, first_name, last_name) для регистрации по /start, phone_number — новый контакт,
+    leads — (услуга, поля лида, готовый текст уведомления), notifications — тексты уведомлений администратору
+    """
+    async def apply(db):
+        if profile is not None:
+            await db.execute(_INSERT_USER_SQL, (user_id, *profile))
+        if phone_number is not None:
+            await db.execute(_UPDATE_CONTACT_SQL, (phone_number, user_id))
+        for service_name, fields, text in leads:
+            cursor = await db.execute(_INSERT_LEAD_SQL, _lead_params(user_id, service_name, fields))
+            await db.execute("INSERT INTO admin_outbox (lead_id, text) VALUES (?, ?)", (cursor.lastrowid, text))
+        for text in notifications:
+            await db.execute("INSERT INTO admin_outbox (text) VALUES (?)", (text,))
+
+    future = _write_queue().submit(apply)
+    if profile is not None:
+        _cache_new_user(user_id, *profile)
+    if phone_number is not None:
+        _cache_contact(user_id, phone_number)
+    if wait:
+        await future
+
+async def _iter_user_chunks(columns: str, active_only: bool, contact_shared: Optional[bool],
+                            after: int, chunk_size: int) -> AsyncIterator[list]:
+    """Пачки строк users по возрастанию user_id (keyset-пагинация, без OFFSET)"""
+    conditions = ["user_id > ?"]
+    if active_only:
+        conditions.append("is_active IS TRUE")
+    if contact_shared is not None:
+        conditions.append("contact_shared IS TRUE" if contact_shared else "contact_shared IS NOT TRUE")
+    sql = f"SELECT {columns} FROM users WHERE {' AND '.join(conditions)} ORDER BY user_id LIMIT ?"
+
+    while True:
+        # Соединение занимаем только на время запроса, пока потребитель обрабатывает пачку
+        async with _pool().reader() as db:
+            rows = await db.execute_fetchall(sql, (after, chunk_size))
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
+
+async def iter_user_id_chunks(active_only: bool = True, contact_shared: Optional[bool] = None,
+                              after: int = 0, chunk_size: int = USER_CHUNK_SIZE) -> AsyncIterator[List[int]]:
+    """Потоковый обход user_id пачками; after — продолжить после этого user_id"""
+    async for rows in _iter_user_chunks("user_id", active_only, contact_shared, after, chunk_size):
+        yield [row[0] for row in rows]
+
+async def iter_user_ids(active_only: bool = True, contact_shared: Optional[bool] = None,
+                        chunk_size: int = USER_CHUNK_SIZE) -> AsyncIterator[int]:
+    """Потоковый обход user_id с постоянным расходом памяти"""
+    async for chunk in iter_user_id_chunks(active_only, contact_shared, chunk_size=chunk_size):
+        for user_id in chunk:
+            yield user_id
 
+async def iter_users(active_only: bool = False, contact_shared: Optional[bool] = None,
+                     chunk_size: int = USER_CHUNK_SIZE) -> AsyncIterator[dict]:
+    """Потоковый обход пользователей со всеми полями, например для выгрузки"""
+    columns = "user_id, username, first_name, last_name, phone_number, contact_shared, is_active, created_at"
+    async for rows in _iter_user_chunks(columns, active_only, contact_shared, 0, chunk_size):
+        for row in rows:
+            yield {
+                'user_id': row[0],
+                'username': row[1],
+                'first_name': row[2],
+                'last_name': row[3],
+                'phone_number': row[4],
+                'contact_shared': bool(row[5]),
+                'is_active': bool(row[6]),
+                'created_at': row[7]
+            }
+
+@timed
 async def get_all_users() -> List[int]:
     """Получение всех пользователей для рассылки"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("SELECT user_id FROM users")
-        users = await cursor.fetchall()
-        return [user[0] for user in users]
+    return [user_id async for user_id in iter_user_ids()]
 
+@timed
 async def get_user_info(user_id: int) -> Optional[dict]:
     """Получение информации о пользователе"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            SELECT username, first_name, last_name, phone_number
-            FROM users WHERE user_id = ?
-        """, (user_id,))
-        result = await cursor.fetchone()
-        if result:
-            return {
-                'username': result[0],
-                'first_name': result[1],
-                'last_name': result[2],
-                'phone_number': result[3]
-            }
-        return None
+    user = await get_user(user_id)
+    if user:
+        return {
+            'username': user['username'],
+            'first_name': user['first_name'],
+            'last_name': user['last_name'],
+            'phone_number': user['phone_number']
+        }
+    return None
 
+@timed
 async def get_user_phone(user_id: int) -> Optional[str]:
     """Получение телефона пользователя"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    user = await get_user(user_id)
+    return user['phone_number'] if user else None
+
+@timed
+async def get_stats(days: int = 7) -> dict:
+    """Сводная статистика из таблиц счётчиков, без просмотра users и leads"""
+    async with _pool().reader() as db:
+        counters = dict(await db.execute_fetchall("SELECT name, value FROM stats_counters"))
+        by_service = await db.execute_fetchall("""
+            SELECT service_name, count FROM stats_leads_by_service
+            WHERE count > 0 ORDER BY count DESC
+        """)
+        by_day = await db.execute_fetchall("""
+            SELECT day, count FROM stats_leads_by_day
+            WHERE day >= date('now', ?) ORDER BY day DESC
+        """, (f"-{days - 1} days",))
+    return {
+        'users_total': counters.get('users_total', 0),
+        'users_active': counters.get('users_active', 0),
+        'users_contact': counters.get('users_contact', 0),
+        'users_with_leads': counters.get('users_with_leads', 0),
+        'leads_total': counters.get('leads_total', 0),
+        'leads_by_service': [tuple(row) for row in by_service],
+        'leads_by_day': [tuple(row) for row in by_day]
+    }
+
+def get_cache_stats() -> dict:
+    """Счётчики попаданий и промахов кэша пользователей"""
+    return user_cache.stats()
+
+@timed
+async def get_media_file_id(path: str, content_hash: str) -> Optional[str]:
+    """Получение сохранённого file_id для файла с указанным хэшем содержимого"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT file_id FROM media_cache WHERE path = ? AND content_hash = ?
+        """, (path, content_hash))
+        return rows[0][0] if rows else None
+
+@timed
+async def save_media_file_id(path: str, content_hash: str, file_id: str):
+    """Сохранение file_id, полученного после загрузки файла в Telegram"""
+    async with _pool().writer() as db:
+        await db.execute("""
+            INSERT OR REPLACE INTO media_cache (path, content_hash, file_id)
+            VALUES (?, ?, ?)
+        """, (path, content_hash, file_id))
+
+@timed
+async def delete_media_file_id(path: str):
+    """Удаление устаревшего file_id"""
+    async with _pool().writer() as db:
+        await db.execute("DELETE FROM media_cache WHERE path = ?", (path,))
+
+@timed
+async def create_broadcast_job(payload: str, report_chat_id: int) -> int:
+    """Создание задачи рассылки; получатели добавляются пачками через add_broadcast_recipients"""
+    async with _pool().writer() as db:
         cursor = await db.execute("""
-            SELECT phone_number FROM users WHERE user_id = ?
-        """, (user_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else None
+            INSERT INTO broadcast_jobs (payload, report_chat_id, fill_cursor) VALUES (?, ?, 0)
+        """, (payload, report_chat_id))
+        return cursor.lastrowid
+
+@timed
+async def add_broadcast_recipients(job_id: int, user_ids: List[int]):
+    """Добавление пачки получателей и сдвиг fill_cursor одной транзакцией"""
+    async with _pool().writer() as db:
+        await db.executemany("""
+            INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) VALUES (?, ?)
+        """, [(job_id, user_id) for user_id in user_ids])
+        await db.execute("""
+            UPDATE broadcast_jobs SET total = total + ?, fill_cursor = ? WHERE id = ?
+        """, (len(user_ids), user_ids[-1], job_id))
+
+@timed
+async def finish_broadcast_recipients(job_id: int):
+    """Отметка о том, что список получателей собран полностью"""
+    async with _pool().writer() as db:
+        await db.execute("UPDATE broadcast_jobs SET fill_cursor = NULL WHERE id = ?", (job_id,))
+
+@timed
+async def get_unfinished_broadcast_jobs() -> List[dict]:
+    """Задачи рассылки, прерванные перезапуском бота"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT id, payload, report_chat_id, total, fill_cursor FROM broadcast_jobs
+            WHERE status = 'running' ORDER BY id
+        """)
+        return [
+            {'id': row[0], 'payload': row[1], 'report_chat_id': row[2], 'total': row[3], 'fill_cursor': row[4]}
+            for row in rows
+        ]
+
+@timed
+async def release_broadcast_recipients(job_id: int):
+    """Возврат в очередь получателей, взятых в работу до перезапуска"""
+    async with _pool().writer() as db:
+        await db.execute("""
+            UPDATE broadcast_recipients SET status = 'pending'
+            WHERE job_id = ? AND status = 'claimed'
+        """, (job_id,))
+
+@timed
+async def claim_broadcast_recipients(job_id: int, limit: int) -> List[int]:
+    """Получение очередной пачки получателей с пометкой claimed"""
+    async with _pool().writer() as db:
+        rows = await db.execute_fetchall("""
+            UPDATE broadcast_recipients SET status = 'claimed'
+            WHERE job_id = ? AND user_id IN (
+                SELECT user_id FROM broadcast_recipients
+                WHERE job_id = ? AND status = 'pending'
+                ORDER BY user_id LIMIT ?
+            )
+            RETURNING user_id
+        """, (job_id, job_id, limit))
+        return sorted(row[0] for row in rows)
+
+@timed
+async def set_broadcast_recipient_status(job_id: int, user_id: int, status: str, error: str = None):
+    """Запись результата доставки; заблокировавший бота пользователь становится неактивным"""
+    future = _write_queue().submit("""
+        UPDATE broadcast_recipients SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ? AND user_id = ?
+    """, (status, error, job_id, user_id))
+    if status == 'blocked':
+        future = _write_queue().submit("UPDATE users SET is_active = FALSE WHERE user_id = ?", (user_id,))
+    await future
+
+@timed
+async def get_broadcast_job_counts(job_id: int) -> Dict[str, int]:
+    """Количество получателей задачи по статусам"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT status, COUNT(*) FROM broadcast_recipients
+            WHERE job_id = ? GROUP BY status
+        """, (job_id,))
+        return {row[0]: row[1] for row in rows}
+
+@timed
+async def finish_broadcast_job(job_id: int):
+    """Отметка о завершении рассылки"""
+    async with _pool().writer() as db:
+        await db.execute("""
+            UPDATE broadcast_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (job_id,))
+
+@timed
+async def get_due_admin_notifications(now: float, limit: int) -> List[dict]:
+    """Уведомления администратору, которые пора отправить, вместе с данными лида"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT o.id, o.text, o.attempts, l.user_id, l.service_name,
+                   l.cargo_name, l.cargo_volume, l.cargo_weight, l.delivery_method
+            FROM admin_outbox o LEFT JOIN leads l ON l.id = o.lead_id
+            WHERE o.status = 'pending' AND o.next_attempt_at <= ?
+            ORDER BY o.id LIMIT ?
+        """, (now, limit))
+        return [
+            {
+                'id': row[0],
+                'text': row[1],
+                'attempts': row[2],
+                'user_id': row[3],
+                'service_name': row[4],
+                'cargo_name': row[5],
+                'cargo_volume': row[6],
+                'cargo_weight': row[7],
+                'delivery_method': row[8]
+            }
+            for row in rows
+        ]
+
+@timed
+async def get_next_admin_notification_time() -> Optional[float]:
+    """Время ближайшей запланированной попытки отправки"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT MIN(next_attempt_at) FROM admin_outbox WHERE status = 'pending'
+        """)
+        return rows[0][0]
+
+@timed
+async def mark_admin_notification_sent(notification_id: int):
+    """Отметка об успешной доставке уведомления"""
+    await _write_queue().submit("""
+        UPDATE admin_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE id = ?
+    """, (notification_id,))
+
+@timed
+async def reschedule_admin_notification(notification_id: int, next_attempt_at: float, error: str):
+    """Перенос неудачной отправки на следующую попытку"""
+    await _write_queue().submit("""
+        UPDATE admin_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+        WHERE id = ?
+    """, (next_attempt_at, error, notification_id))
+
+@timed
+async def fail_admin_notification(notification_id: int, error: str):
+    """Отказ от доставки уведомления: ошибка, которую повтор не исправит, или исчерпаны попытки"""
+    await _write_queue().submit("""
+        UPDATE admin_outbox SET status = 'failed', attempts = attempts + 1, last_error = ?
+        WHERE id = ?
+    """, (error, notification_id))
+
+@timed
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Состояние и сериализованные данные FSM по ключу"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("SELECT state, data FROM fsm_storage WHERE key = ?", (key,))
+        return (rows[0][0], rows[0][1]) if rows else None
+
+@timed
+async def save_fsm_record(key: str, state: Optional[str], data: Optional[str], updated_at: float,
+                          wait: bool = True) -> asyncio.Future:
+    """Запись состояния FSM; пустая запись удаляется. Возвращает future коммита для записи без ожидания"""
+    if state is None and data is None:
+        future = _write_queue().submit("DELETE FROM fsm_storage WHERE key = ?", (key,))
+    else:
+        future = _write_queue().submit("""
+            INSERT OR REPLACE INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+        """, (key, state, data, updated_at))
+    if wait:
+        await future
+    return future
+
+@timed
+async def delete_expired_fsm_records(updated_before: float, limit: int) -> int:
+    """Удаление пачки заброшенных диалогов; возвращает число удалённых записей"""
+    async with _pool().writer() as db:
+        cursor = await db.execute("""
+            DELETE FROM fsm_storage WHERE key IN (
+                SELECT key FROM fsm_storage WHERE updated_at < ? LIMIT ?
+            )
+        """, (updated_before, limit))
+        return cursor.rowcount
+
+@timed
+async def add_analytics_events(events: List[Tuple[int, int, str, str]]):
+    """Пачка событий аналитики (время, user_id, вид, имя) одной операцией очереди записи"""
+    async def apply(db):
+        await db.executemany("""
+            INSERT INTO analytics_events (created_at, user_id, kind, name) VALUES (?, ?, ?, ?)
+        """, events)
+
+    await _write_queue().submit(apply)
+
+@timed
+async def rollup_analytics(since: int, delete_before: int):
+    """Пересчёт сводок по часам и дням начиная с часа и дня, где ещё могут появиться события.
+
+    Последний посчитанный час и день пересчитываются целиком, поэтому число уникальных пользователей
+    в сводках точное. События старше delete_before удаляются, если уже попали в сводки
+    """
+    async with _pool().writer() as db:
+        rows = await db.execute_fetchall("""
+            SELECT (SELECT MAX(hour) FROM analytics_hourly),
+                   (SELECT CAST(strftime('%s', MAX(day)) AS INTEGER) FROM analytics_daily)
+        """)
+        last_hour, last_day = rows[0]
+        hour_from = min(last_hour, since) // 3600 * 3600 if last_hour is not None else 0
+        day_from = min(last_day, since) // 86400 * 86400 if last_day is not None else 0
+        await db.execute("""
+            INSERT OR REPLACE INTO analytics_hourly (hour, kind, name, events, users)
+            SELECT created_at / 3600 * 3600, kind, name, COUNT(*), COUNT(DISTINCT user_id)
+            FROM analytics_events WHERE created_at >= ?
+            GROUP BY created_at / 3600, kind, name
+        """, (hour_from,))
+        await db.execute("""
+            INSERT OR REPLACE INTO analytics_daily (day, kind, name, events, users)
+            SELECT date(created_at, 'unixepoch'), kind, name, COUNT(*), COUNT(DISTINCT user_id)
+            FROM analytics_events WHERE created_at >= ?
+            GROUP BY created_at / 86400, kind, name
+        """, (day_from,))
+        await db.execute("DELETE FROM analytics_events WHERE created_at < ?",
+                         (min(delete_before, hour_from, day_from),))
+
+@timed
+async def get_analytics_daily(days: int) -> Dict[Tuple[str, str], Tuple[int, int]]:
+    """События и пользователи по виду и имени события за последние days дней (сумма дневных сводок)"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT kind, name, SUM(events), SUM(users) FROM analytics_daily
+            WHERE day >= date('now', ?) GROUP BY kind, name
+        """, (f"-{days - 1} days",))
+        return {(row[0], row[1]): (row[2], row[3]) for row in rows}
+
+@timed
+async def get_analytics_top(kind: str, since: int, limit: int) -> List[Tuple[str, int]]:
+    """Самые частые события одного вида с начала часа since по часовым сводкам"""
+    async with _pool().reader() as db:
+        rows = await db.execute_fetchall("""
+            SELECT name, SUM(events) FROM analytics_hourly
+            WHERE hour >= ? AND kind = ? GROUP BY name ORDER BY 2 DESC LIMIT ?
+        """, (since // 3600 * 3600, kind, limit))
+        return [tuple(row) for row in rows]
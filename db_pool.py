@@ -0,0 +1,211 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional, Union
+
+import aiosqlite
+
+import metrics
+from config import METRICS_ENABLED
+
+# Настройки соединений: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL делает fsync только при checkpoint
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+# Размер кэша подготовленных выражений sqlite3 на каждое соединение
+CACHED_STATEMENTS = 256
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с SQLite: одно для записи и несколько для чтения"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    async def open(self, path: str, readers: int = 4):
+        """Открытие соединений; повторный вызов для уже открытого пула ничего не делает"""
+        if self.is_open:
+            return
+        self.path = path
+        self._writer = await self._connect(read_only=False)
+        self._idle_readers = asyncio.Queue()
+        try:
+            for _ in range(max(readers, 1)):
+                conn = await self._connect(read_only=True)
+                self._readers.append(conn)
+                self._idle_readers.put_nowait(conn)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        """Закрытие всех соединений при остановке бота"""
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            await self._writer.commit()
+            await self._writer.close()
+            self._writer = None
+        for conn in self._readers:
+            await conn.close()
+        self._readers.clear()
+        self._idle_readers = None
+
+    def _check_open(self):
+        if not self.is_open:
+            raise RuntimeError("Соединение с базой данных не открыто, вызовите init_db()")
+
+    @asynccontextmanager
+    async def writer(self):
+        """Единственное соединение для записи; транзакция фиксируется при выходе из блока"""
+        self._check_open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение только для чтения из пула"""
+        self._check_open()
+        queue = self._idle_readers
+        conn = await queue.get()
+        try:
+            yield conn
+        finally:
+            queue.put_nowait(conn)
+
+
+class WriteQueue:
+    """Фоновая запись с групповым коммитом: накопленные операции выполняются одной транзакцией"""
+
+    def __init__(self, pool: ConnectionPool, max_delay: float = 0.005, max_batch: int = 500):
+        self.pool = pool
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Запись всего, что осталось в очереди, и остановка фоновой задачи"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def submit(self, operation: Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]],
+               params: tuple = ()) -> asyncio.Future:
+        """Постановка SQL-выражения или функции от соединения в очередь; future завершается после коммита"""
+        future = asyncio.get_running_loop().create_future()
+        if self._task is None:
+            raise RuntimeError("Очередь записи не запущена, вызовите init_db()")
+        self._queue.put_nowait((operation, params, future))
+        return future
+
+    async def flush(self):
+        """Ожидание записи всех операций, поставленных в очередь до этого вызова"""
+        async def barrier(conn):
+            pass
+        await self.submit(barrier)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                # Короткая пауза собирает в одну транзакцию всё, что придёт одновременно
+                await asyncio.sleep(self.max_delay)
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                start = time.perf_counter()
+                try:
+                    await self._apply(batch)
+                except Exception:
+                    # Одна ошибочная операция не должна отменять остальные — повторяем по одной
+                    for item in batch:
+                        await self._apply([item])
+            except BaseException:
+                # Отмена задачи посреди пачки: ожидающие коммита не должны висеть вечно
+                self._fail_pending(batch)
+                raise
+            if METRICS_ENABLED:
+                metrics.DB_WRITE_BATCH_SECONDS.observe(time.perf_counter() - start)
+                metrics.DB_WRITE_BATCH_SIZE.observe(len(batch))
+
+    def _fail_pending(self, batch: list):
+        """Ошибка для незавершённых операций пачки и всего, что осталось в очереди"""
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("Очередь записи остановлена до коммита"))
+
+    async def _apply(self, batch: list):
+        try:
+            async with self.pool.writer() as conn:
+                for operation, group in _group_statements(batch):
+                    if callable(operation):
+                        await operation(conn)
+                    elif len(group) == 1:
+                        await conn.execute(operation, group[0])
+                    else:
+                        await conn.executemany(operation, group)
+        except Exception as e:
+            if len(batch) > 1:
+                raise
+            future = batch[0][2]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+def _group_statements(batch: list):
+    """Объединение подряд идущих одинаковых выражений для executemany"""
+    groups = []
+    for operation, params, _ in batch:
+        if groups and groups[-1][0] == operation and not callable(operation):
+            groups[-1][1].append(params)
+        else:
+            groups.append((operation, [params]))
+    return groups
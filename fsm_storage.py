@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import analytics
+import database as db
+import tenants
+from cache import MISSING, TTLCache
+from config import FSM_CACHE_SIZE, FSM_TTL
+
+# Как часто удалять заброшенные диалоги и сколько записей удалять за одну транзакцию
+SWEEP_INTERVAL = 600.0
+SWEEP_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _make_key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def _dumps(data: Dict[str, Any]) -> Optional[str]:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _loads(data: Optional[str]) -> Dict[str, Any]:
+    return json.loads(data) if data else {}
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в базе бота с кэшем в памяти и удалением устаревших диалогов"""
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, ttl: float = FSM_TTL):
+        self.ttl = ttl
+        # Кэш хранит [state, data]; без кэша (несколько процессов) каждое чтение идёт в базу
+        self._cache = TTLCache(cache_size, ttl)
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def _load(self, key: str) -> list:
+        record = self._cache.get(key)
+        if record is MISSING:
+            row = await db.get_fsm_record(key)
+            record = [row[0], _loads(row[1])] if row else [None, {}]
+            self._cache.set(key, record)
+        return record
+
+    async def _save(self, key: str, record: list):
+        self._cache.set(key, record)
+        # С кэшем запись в базу не задерживает обработчик: этот процесс читает из кэша
+        future = await db.save_fsm_record(key, record[0], _dumps(record[1]), time.time(),
+                                          wait=self._cache.maxsize <= 0)
+        if not future.done():
+            future.add_done_callback(lambda future: self._forget_unsaved(key, record, future))
+
+    def _forget_unsaved(self, key: str, record: list, future: asyncio.Future):
+        """Ошибка записи без ожидания: кэш не должен расходиться с базой"""
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error("Не удалось сохранить состояние FSM %s: %s", key, future.exception())
+        # Более новая запись ключа сама сообщит о своей ошибке
+        if self._cache.get(key, count=False) is record:
+            self._cache.pop(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = _make_key(key)
+        record = await self._load(storage_key)
+        state = state.state if isinstance(state, State) else state
+        if state is not None and state != record[0]:
+            analytics.track(key.user_id, analytics.STATE, state)
+        await self._save(storage_key, [state, record[1]])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(_make_key(key))
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = _make_key(key)
+        record = await self._load(storage_key)
+        await self._save(storage_key, [record[0], data.copy()])
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(_make_key(key))
+        return record[1].copy()
+
+    async def sweep(self) -> int:
+        """Удаление диалогов, которые не менялись дольше ttl"""
+        updated_before = time.time() - self.ttl
+        deleted = 0
+        while True:
+            count = await db.delete_expired_fsm_records(updated_before, SWEEP_BATCH_SIZE)
+            deleted += count
+            if count < SWEEP_BATCH_SIZE:
+                break
+            # Отдаём писателя другим операциям между пачками
+            await asyncio.sleep(0)
+        if deleted:
+            logger.info("Удалено устаревших состояний FSM: %s", deleted)
+        return deleted
+
+    async def _sweep_forever(self):
+        while True:
+            # Хранилище общее, а состояния лежат в базе каждого бота
+            for tenant in tenants.all_tenants():
+                with tenants.activate(tenant):
+                    try:
+                        await self.sweep()
+                    except Exception as e:
+                        logger.error("Ошибка очистки состояний FSM бота %s: %s", tenant.name, e)
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    def start_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
@@ -1,8 +1,50 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from config import YANDEX_MAPS_LINK, SOCIAL_LINKS, COURSE_POST_LINK
+from functools import lru_cache
+from pydantic import ConfigDict
 
-def get_main_menu():
+import tenants
+
+# Разметки и кнопки aiogram изменяемые (MutableTelegramObject). Общие экземпляры отдаются во все
+# обработчики, поэтому они замораживаются: модели frozen, ряды кнопок — списки только для чтения
+class _ReadOnlyList(list):
+    """Список, который нельзя изменить; для aiogram и pydantic это обычный list"""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Общую клавиатуру нельзя изменять — постройте новую через builder")
+
+    def __reduce_ex__(self, protocol):
+        # Копия (copy.deepcopy, model_copy(deep=True)) — уже обычный изменяемый список
+        return list, (list(self),)
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+class _FrozenKeyboardButton(KeyboardButton):
+    model_config = ConfigDict(frozen=True, defer_build=False)
+
+class _FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True, defer_build=False)
+
+class _FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True, defer_build=False)
+
+class _FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True, defer_build=False)
+
+def _freeze(markup):
+    """Неизменяемая копия разметки из builder.as_markup()"""
+    if isinstance(markup, ReplyKeyboardMarkup):
+        markup_class, button_class, field = _FrozenReplyKeyboardMarkup, _FrozenKeyboardButton, "keyboard"
+    else:
+        markup_class, button_class, field = _FrozenInlineKeyboardMarkup, _FrozenInlineKeyboardButton, "inline_keyboard"
+    rows = _ReadOnlyList(
+        _ReadOnlyList(button_class.model_construct(button.model_fields_set, **dict(button)) for button in row)
+        for row in getattr(markup, field)
+    )
+    return markup_class.model_construct(markup.model_fields_set, **{**dict(markup), field: rows})
+
+def _build_main_menu():
     """Главное меню"""
     builder = ReplyKeyboardBuilder()
     builder.add(
@@ -14,9 +56,9 @@ def get_main_menu():
         KeyboardButton(text="❓ FAQ")
     )
     builder.adjust(2, 2, 2)
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
-def get_services_menu():
+def _build_services_menu():
     """Меню услуг"""
     builder = ReplyKeyboardBuilder()
     builder.add(
@@ -30,9 +72,9 @@ def get_services_menu():
         KeyboardButton(text="⬅️ Назад в меню")
     )
     builder.adjust(2, 2, 2, 1, 1)
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
-def get_delivery_methods():
+def _build_delivery_methods():
     """Способы доставки"""
     builder = ReplyKeyboardBuilder()
     builder.add(
@@ -43,9 +85,9 @@ def get_delivery_methods():
         KeyboardButton(text="⬅️ Назад в меню")
     )
     builder.adjust(2, 2, 1)
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
-def get_contact_keyboard():
+def _build_contact_keyboard():
     """Клавиатура для отправки контакта"""
     builder = ReplyKeyboardBuilder()
     builder.add(
@@ -53,38 +95,39 @@ def get_contact_keyboard():
         KeyboardButton(text="⬅️ Назад в меню")
     )
     builder.adjust(1, 1)
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
-def get_back_to_menu():
+def _build_back_to_menu():
     """Кнопка назад в меню"""
     builder = ReplyKeyboardBuilder()
     builder.add(KeyboardButton(text="⬅️ Назад в меню"))
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
-def get_about_us_inline():
+def _build_about_us_inline(links: dict):
     """Инлайн клавиатура для раздела О нас"""
     builder = InlineKeyboardBuilder()
     builder.add(
-        InlineKeyboardButton(text="🌐 Наш сайт", url="https://cnbridge.ru"),
+        InlineKeyboardButton(text="🌐 Наш сайт", url=links["WEBSITE_LINK"]),
         InlineKeyboardButton(text="🏢 Карточка организации", callback_data="company_card"),
         InlineKeyboardButton(text="📱 Наши соцсети", callback_data="social_networks")
     )
     builder.adjust(1)
-    return builder.as_markup()
+    return _freeze(builder.as_markup())
 
-def get_social_networks():
+def _build_social_networks(links: dict):
     """Социальные сети"""
+    social_links = links["SOCIAL_LINKS"]
     builder = InlineKeyboardBuilder()
     builder.add(
-        InlineKeyboardButton(text="📱 Telegram", url=SOCIAL_LINKS["telegram"]),
-        InlineKeyboardButton(text="📸 Instagram", url=SOCIAL_LINKS["instagram"]),
-        InlineKeyboardButton(text="🌐 VK", url=SOCIAL_LINKS["vk"]),
-        InlineKeyboardButton(text="📰 Дзен", url=SOCIAL_LINKS["zen"])
+        InlineKeyboardButton(text="📱 Telegram", url=social_links["telegram"]),
+        InlineKeyboardButton(text="📸 Instagram", url=social_links["instagram"]),
+        InlineKeyboardButton(text="🌐 VK", url=social_links["vk"]),
+        InlineKeyboardButton(text="📰 Дзен", url=social_links["zen"])
     )
     builder.adjust(2, 2)
-    return builder.as_markup()
+    return _freeze(builder.as_markup())
 
-def get_materials_menu():
+def _build_materials_menu():
     """Меню полезных материалов"""
     builder = ReplyKeyboardBuilder()
     builder.add(
@@ -93,14 +136,18 @@ def get_materials_menu():
         KeyboardButton(text="⬅️ Назад в меню")
     )
     builder.adjust(1, 1, 1)
-    return builder.as_markup(resize_keyboard=True)
+    return _freeze(builder.as_markup(resize_keyboard=True))
 
 def get_service_action(service_name: str):
-    """Кнопки для услуг"""
+    """Кнопки для услуг (одна общая разметка на каждое название услуги у каждого бота)"""
+    return _build_service_action(tenants.current(), service_name)
+
+@lru_cache(maxsize=256)
+def _build_service_action(tenant: tenants.Tenant, service_name: str):
     builder = InlineKeyboardBuilder()
     if service_name == "Перевод денег":
         builder.add(
-            InlineKeyboardButton(text="📈 Курс", url=COURSE_POST_LINK),
+            InlineKeyboardButton(text="📈 Курс", url=tenant.links["COURSE_POST_LINK"]),
             InlineKeyboardButton(text="📞 Получить услугу", callback_data="get_service_Перевод денег")
         )
         builder.adjust(2)
@@ -110,15 +157,83 @@ def get_service_action(service_name: str):
             InlineKeyboardButton(text="📞 Получить услугу", callback_data=f"get_service_{service_callback}")
         )
         builder.adjust(1)
-    return builder.as_markup()
+    return _freeze(builder.as_markup())
 
-def get_admin_keyboard():
+def _build_admin_keyboard():
     """Админ клавиатура"""
     builder = ReplyKeyboardBuilder()
     builder.add(
         KeyboardButton(text="📢 Создать рассылку"),
         KeyboardButton(text="📊 Статистика"),
+        KeyboardButton(text="📈 Воронки"),
+        KeyboardButton(text="📥 Выгрузка пользователей"),
         KeyboardButton(text="⬅️ Назад в меню")
     )
-    builder.adjust(2, 1)
-    return builder.as_markup(resize_keyboard=True)
+    builder.adjust(2, 2, 1)
+    return _freeze(builder.as_markup(resize_keyboard=True))
+
+# Статичные клавиатуры строятся один раз при импорте и замораживаются (_freeze), поэтому
+# один экземпляр безопасно отдавать во все обработчики; попытка изменить его — ошибка
+MARKUPS = {
+    "main_menu": _build_main_menu(),
+    "services_menu": _build_services_menu(),
+    "delivery_methods": _build_delivery_methods(),
+    "contact_keyboard": _build_contact_keyboard(),
+    "back_to_menu": _build_back_to_menu(),
+    "materials_menu": _build_materials_menu(),
+    "admin_keyboard": _build_admin_keyboard(),
+}
+
+# Клавиатуры со ссылками бренда строятся для каждого бота при первом обращении
+TENANT_MARKUPS = {
+    "about_us_inline": _build_about_us_inline,
+    "social_networks": _build_social_networks,
+}
+
+@lru_cache(maxsize=256)
+def _build_tenant_markup(tenant: tenants.Tenant, name: str):
+    return TENANT_MARKUPS[name](tenant.links)
+
+def get_markup(name: str):
+    """Общая разметка из реестра по имени; service_action:<услуга> — кнопки услуги"""
+    if name.startswith("service_action:"):
+        return get_service_action(name.split(":", 1)[1])
+    if name in TENANT_MARKUPS:
+        return _build_tenant_markup(tenants.current(), name)
+    return MARKUPS[name]
+
+def get_main_menu():
+    """Главное меню"""
+    return MARKUPS["main_menu"]
+
+def get_services_menu():
+    """Меню услуг"""
+    return MARKUPS["services_menu"]
+
+def get_delivery_methods():
+    """Способы доставки"""
+    return MARKUPS["delivery_methods"]
+
+def get_contact_keyboard():
+    """Клавиатура для отправки контакта"""
+    return MARKUPS["contact_keyboard"]
+
+def get_back_to_menu():
+    """Кнопка назад в меню"""
+    return MARKUPS["back_to_menu"]
+
+def get_about_us_inline():
+    """Инлайн клавиатура для раздела О нас"""
+    return get_markup("about_us_inline")
+
+def get_social_networks():
+    """Социальные сети"""
+    return get_markup("social_networks")
+
+def get_materials_menu():
+    """Меню полезных материалов"""
+    return MARKUPS["materials_menu"]
+
+def get_admin_keyboard():
+    """Админ клавиатура"""
+    return MARKUPS["admin_keyboard"]
@@ -1,25 +1,131 @@
 import asyncio
 import logging
+from typing import List
+
 from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
-from config import BOT_TOKEN
-from database import init_db
+from config import (MEDIA_WARMUP, BOT_MODE, BOT_API_SERVER,
+                    METRICS_ENABLED, METRICS_HOST, METRICS_PORT)
+from content import get_catalog
+from database import init_db, close_db
+from fsm_storage import SQLiteStorage
 from handlers import router
+import analytics
+import api_session
+import broadcast
+import media_cache
+import metrics
+import outbox
+import profiler
+import tenants
+import throttling
+import user_context
 
-async def main():
-    # Инициализация базы данных
-    await init_db()
+async def on_startup(bots: List[Bot], dispatcher: Dispatcher, primary: bool = True, worker_index: int = 0):
+    # Метрики у каждого процесса свои, поэтому и порт у каждого воркера свой
+    if METRICS_ENABLED:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT + worker_index)
+    
+    profiler.start_watchdog()
+    
+    # События копит каждый процесс, сводки считает один
+    analytics.start(rollups=primary)
+    # Изменённые и новые файлы в files/ готовит один процесс, остальные перечитывают его манифест
+    media_cache.start(rebuild=primary)
     
-    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher()
+    # Фоновые задачи выполняет только один процесс, даже если webhook обслуживают несколько
+    if not primary:
+        return
+    
+    dispatcher.fsm.storage.start_sweeper()
+    # Задачи, созданные внутри activate, работают от имени своего бота
+    for bot in bots:
+        with tenants.activate(tenants.for_bot(bot)) as tenant:
+            outbox.start(bot)
+            await broadcast.resume_broadcasts(bot)
+            
+            # Прогрев кэша file_id выполняется в фоне, чтобы не задерживать запуск
+            if MEDIA_WARMUP and tenant.admin_id:
+                with api_session.lane(api_session.ADMIN):
+                    asyncio.create_task(media_cache.warm_up(bot, tenant.admin_id))
+
+async def on_shutdown():
+    await broadcast.stop_broadcasts()
+    await analytics.stop()
+    await media_cache.stop()
+    for tenant in tenants.all_tenants():
+        with tenants.activate(tenant):
+            await outbox.stop()
+            await close_db()
+    await metrics.stop_server()
+    profiler.stop_watchdog()
+
+def create_session() -> api_session.SchedulingSession:
+    """HTTP-сессия с адресом Bot API из настроек; одна на все боты процесса"""
+    if BOT_API_SERVER:
+        session = api_session.SchedulingSession(api=TelegramAPIServer.from_base(BOT_API_SERVER))
+    else:
+        session = api_session.SchedulingSession()
+    if METRICS_ENABLED:
+        metrics.setup_session(session)
+    return session
+
+def create_bots() -> List[Bot]:
+    """Боты из TENANTS_FILE (или один из BOT_TOKEN) на общей сессии"""
+    session = create_session()
+    return [Bot(token=tenant.token, parse_mode=ParseMode.HTML, session=session)
+            for tenant in tenants.all_tenants()]
+
+async def init_databases():
+    """Схема и миграции базы каждого бота"""
+    for tenant in tenants.all_tenants():
+        with tenants.activate(tenant):
+            await init_db()
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер с обработчиками и хуками запуска и остановки"""
+    dp = tenants.TenantDispatcher(storage=SQLiteStorage())
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     
     # Регистрация роутеров
+    throttling.setup(router)
+    user_context.setup(router)
+    analytics.setup(router)
+    profiler.setup(router)
     dp.include_router(router)
+    if METRICS_ENABLED:
+        metrics.setup(dp, router)
+    return dp
+
+def prepare_media():
+    """Пережатие новых файлов из files/ и манифест; предупреждает об отсутствующих картинках и гайдах"""
+    images = set()
+    for tenant in tenants.all_tenants():
+        images.update(get_catalog(tenant).images())
+    media_cache.prepare(sorted(images))
+
+async def main():
+    tenants.load()
+    prepare_media()
+    
+    # Инициализация базы данных
+    await init_databases()
+    
+    bots = create_bots()
+    dp = create_dispatcher()
     
-    # Запуск бота
-    await dp.start_polling(bot)
+    # Запуск ботов; при переходе с webhook на polling webhook нужно снять
+    for bot in bots:
+        await bot.delete_webhook()
+    await dp.start_polling(*bots)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        import webhook
+        webhook.run()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+import database as db
+import media_manifest
+import tenants
+from media_manifest import Asset, normalize_name
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """Хэш подготовленного файла и его file_id в Telegram"""
+
+    __slots__ = ("content_hash", "file_id")
+
+    def __init__(self, content_hash: str, file_id: Optional[str]):
+        self.content_hash = content_hash
+        self.file_id = file_id
+
+
+# Как часто фоновая задача проверяет, не изменились ли файлы в files/
+REFRESH_INTERVAL = 5.0
+
+_assets: Optional[Dict[str, Asset]] = None
+# Исходные файлы и версия manifest.json, по которым собран манифест в памяти
+_sources: Optional[List[str]] = None
+_manifest_version: Optional[int] = None
+# file_id у каждого бота свой, поэтому ключ — имя бота и имя файла
+_entries: Dict[Tuple[str, str], _Entry] = {}
+_upload_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+_refresh_lock = asyncio.Lock()
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def prepare(required: Iterable[str] = ()) -> Dict[str, Asset]:
+    """Сборка манифеста при запуске; воркеры webhook читают уже готовый манифест"""
+    global _assets, _sources, _manifest_version
+    _sources = media_manifest.sources()
+    _assets = media_manifest.prepare(required)
+    _manifest_version = media_manifest.manifest_version()
+    _entries.clear()
+    return _assets
+
+
+def _get_assets() -> Dict[str, Asset]:
+    global _assets, _manifest_version
+    if _assets is None:
+        _manifest_version = media_manifest.manifest_version()
+        _assets = media_manifest.load()
+    return _assets
+
+
+def _is_outdated(assets: Dict[str, Asset], rebuild: bool) -> bool:
+    """Изменились ли исходники (rebuild) или manifest.json другого процесса; только stat и listdir"""
+    if not rebuild:
+        return media_manifest.manifest_version() != _manifest_version
+    return (media_manifest.sources() != _sources
+            or any(media_manifest.is_stale(asset) for asset in assets.values()))
+
+
+def _reload(rebuild: bool) -> Tuple[List[str], Dict[str, Asset], Optional[int]]:
+    # Список берётся до сборки: файл, добавленный во время неё, попадёт в следующую
+    sources = media_manifest.sources()
+    assets = media_manifest.build() if rebuild else media_manifest.load()
+    return sources, assets, media_manifest.manifest_version()
+
+
+async def refresh(rebuild: bool = True) -> bool:
+    """Обновление манифеста в памяти, если файлы изменились; пережатие и хэши считаются в потоке.
+
+    rebuild=False — только перечитать manifest.json, который пересобрал другой процесс.
+    У изменённого файла меняется хэш: _resolve не найдёт старый file_id, и файл загрузится заново
+    """
+    global _assets, _sources, _manifest_version
+    async with _refresh_lock:
+        previous = _get_assets()
+        if not await asyncio.to_thread(_is_outdated, previous, rebuild):
+            return False
+        _sources, _assets, _manifest_version = await asyncio.to_thread(_reload, rebuild)
+    changed = sorted(name for name, asset in _assets.items()
+                     if name not in previous or previous[name].hash != asset.hash)
+    removed = sorted(set(previous) - set(_assets))
+    if changed or removed:
+        logger.info("Манифест медиа обновлён, изменены: %s, удалены: %s",
+                    ", ".join(changed) or "-", ", ".join(removed) or "-")
+    return True
+
+
+async def _run_refresh(rebuild: bool):
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            await refresh(rebuild)
+        except Exception as e:
+            logger.error("Не удалось обновить манифест медиа: %s", e)
+
+
+def start(rebuild: bool = True):
+    """Фоновая проверка files/; пересобирает манифест один процесс, остальные перечитывают manifest.json"""
+    global _refresh_task
+    if _refresh_task is None:
+        _refresh_task = asyncio.create_task(_run_refresh(rebuild))
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        await asyncio.gather(_refresh_task, return_exceptions=True)
+        _refresh_task = None
+
+
+def get_asset(filename: str) -> Optional[Asset]:
+    """Файл из манифеста в памяти по имени без учёта регистра и .jpeg/.jpg; None, если файла нет"""
+    return _get_assets().get(normalize_name(filename))
+
+
+def exists(filename: str) -> bool:
+    return get_asset(filename) is not None
+
+
+def _extract_file_id(message: Message) -> Optional[str]:
+    if message.photo:
+        return message.photo[-1].file_id
+    if message.document:
+        return message.document.file_id
+    return None
+
+
+async def _resolve(asset: Asset) -> _Entry:
+    """Запись кэша для файла; file_id ищется в базе по хэшу из манифеста"""
+    key = (tenants.current().name, asset.name)
+    entry = _entries.get(key)
+    if entry is None or entry.content_hash != asset.hash:
+        file_id = await db.get_media_file_id(asset.name, asset.hash)
+        entry = _Entry(asset.hash, file_id)
+        _entries[key] = entry
+    return entry
+
+
+async def _send(filename: str, send: Callable[..., Awaitable[Message]]) -> Message:
+    asset = get_asset(filename)
+    if asset is None:
+        # Обработчики проверяют exists() заранее; сюда попадаем, только если файл пропал из манифеста
+        raise FileNotFoundError(filename)
+    entry = await _resolve(asset)
+
+    if entry.file_id:
+        try:
+            return await send(entry.file_id)
+        except TelegramBadRequest as e:
+            if "file" not in e.message.lower():
+                raise
+            # file_id больше не принимается Telegram — загружаем файл заново
+            logger.warning("Сброшен file_id для %s: %s", asset.name, e.message)
+            entry.file_id = None
+            await db.delete_media_file_id(asset.name)
+
+    lock = _upload_locks.setdefault((tenants.current().name, asset.name), asyncio.Lock())
+    async with lock:
+        # Пока ждали блокировку, файл мог загрузить параллельный запрос
+        if entry.file_id:
+            return await send(entry.file_id)
+
+        sent = await send(FSInputFile(asset.abspath, filename=asset.name))
+        file_id = _extract_file_id(sent)
+        if file_id:
+            entry.file_id = file_id
+            await db.save_media_file_id(asset.name, entry.content_hash, file_id)
+        return sent
+
+
+async def answer_photo(message: Message, filename: str, **kwargs) -> Message:
+    """Ответ фото из папки files: по file_id, если файл уже загружался, иначе с диска"""
+    return await _send(filename, lambda photo: message.answer_photo(photo=photo, **kwargs))
+
+
+async def answer_document(message: Message, filename: str, **kwargs) -> Message:
+    """Ответ документом из папки files с кэшированием file_id"""
+    return await _send(filename, lambda document: message.answer_document(document=document, **kwargs))
+
+
+async def warm_up(bot: Bot, chat_id: int) -> int:
+    """Предварительная загрузка всех файлов из манифеста, которых ещё нет в кэше"""
+    uploaded = 0
+    for asset in list(_get_assets().values()):
+        method = bot.send_photo if asset.is_photo else bot.send_document
+        try:
+            entry = await _resolve(asset)
+            if entry.file_id:
+                continue
+            sent = await _send(asset.name, lambda media: method(chat_id, media, disable_notification=True))
+            uploaded += 1
+            try:
+                await bot.delete_message(chat_id, sent.message_id)
+            except TelegramBadRequest:
+                pass
+        except Exception as e:
+            logger.warning("Не удалось загрузить %s при прогреве кэша: %s", asset.name, e)
+
+    logger.info("Прогрев медиа-кэша завершён, загружено файлов: %s", uploaded)
+    return uploaded
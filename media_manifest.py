@@ -0,0 +1,217 @@
+"""Подготовка файлов из files/ и манифест: имя → файл, хэш, размеры.
+
+Запуск из корня проекта (то же выполняется при старте бота):
+    python media_manifest.py
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+OPTIMIZED_DIR = os.path.join(FILES_DIR, "optimized")
+MANIFEST_PATH = os.path.join(FILES_DIR, "manifest.json")
+
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+DOCUMENT_EXTENSIONS = {".pdf"}
+
+# Telegram хранит фото не больше 1280 пикселей по длинной стороне — больше загружать незачем
+PHOTO_MAX_SIDE = 1280
+PHOTO_QUALITY = 85
+
+# Файлы, которые обработчики отправляют не из content.json
+REQUIRED_FILES = ["welcome.jpg", "guide1.pdf", "guide2.pdf"]
+
+logger = logging.getLogger(__name__)
+
+
+class Asset:
+    """Подготовленный файл: путь относительно files/, хэш содержимого, размеры для фото.
+
+    source_mtime и source_size — время изменения (нс) и размер исходника при подготовке
+    """
+
+    __slots__ = ("name", "source", "source_hash", "source_mtime", "source_size", "path", "hash", "width", "height",
+                 "size")
+
+    def __init__(self, name: str, source: str, source_hash: str, path: str, hash: str,
+                 width: Optional[int] = None, height: Optional[int] = None, size: int = 0,
+                 source_mtime: Optional[int] = None, source_size: Optional[int] = None):
+        self.name = name
+        self.source = source
+        self.source_hash = source_hash
+        self.source_mtime = source_mtime
+        self.source_size = source_size
+        self.path = path
+        self.hash = hash
+        self.width = width
+        self.height = height
+        self.size = size
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "name"}
+
+    @property
+    def abspath(self) -> str:
+        return os.path.join(FILES_DIR, self.path)
+
+    @property
+    def is_photo(self) -> bool:
+        return os.path.splitext(self.name)[1] in PHOTO_EXTENSIONS
+
+
+def normalize_name(filename: str) -> str:
+    """Имя, по которому файл ищут обработчики: нижний регистр, .jpeg → .jpg, без пробелов"""
+    stem, extension = os.path.splitext(filename.strip())
+    extension = extension.lower()
+    if extension == ".jpeg":
+        extension = ".jpg"
+    return stem.strip().lower().replace(" ", "_") + extension
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sources() -> List[str]:
+    """Исходные файлы в files/, которые попадают в манифест"""
+    if not os.path.isdir(FILES_DIR):
+        return []
+    return [
+        source for source in sorted(os.listdir(FILES_DIR))
+        if os.path.splitext(source)[1].lower() in PHOTO_EXTENSIONS | DOCUMENT_EXTENSIONS
+        and os.path.isfile(os.path.join(FILES_DIR, source))
+    ]
+
+
+def manifest_version() -> Optional[int]:
+    """Время изменения manifest.json: меняется, когда другой процесс пересобрал манифест"""
+    try:
+        return os.stat(MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def is_stale(asset: Asset) -> bool:
+    """Исходный файл заменён или удалён после подготовки"""
+    try:
+        stat = os.stat(os.path.join(FILES_DIR, asset.source))
+    except OSError:
+        return True
+    return stat.st_mtime_ns != asset.source_mtime or stat.st_size != asset.source_size
+
+
+def _optimize_photo(source_path: str, name: str) -> tuple:
+    """JPEG не больше PHOTO_MAX_SIDE по длинной стороне; возвращает путь и размеры"""
+    os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+    output_name = os.path.splitext(name)[0] + ".jpg"
+    output_path = os.path.join(OPTIMIZED_DIR, output_name)
+    with Image.open(source_path) as source:
+        source_format = source.format
+        # Учитываем поворот из EXIF, иначе снимок с телефона окажется на боку
+        image = ImageOps.exif_transpose(source)
+        original_size = image.size
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE), Image.LANCZOS)
+        image.save(output_path, "JPEG", quality=PHOTO_QUALITY, optimize=True, progressive=True)
+        width, height = image.size
+    # Небольшой JPEG после пережатия бывает больше исходного — тогда оставляем исходный
+    if (source_format == "JPEG" and image.size == original_size
+            and os.path.getsize(output_path) >= os.path.getsize(source_path)):
+        shutil.copyfile(source_path, output_path)
+    return os.path.relpath(output_path, FILES_DIR), width, height
+
+
+def load() -> Dict[str, Asset]:
+    """Манифест с диска; пустой, если его ещё нет"""
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {name: Asset(name=name, **entry) for name, entry in raw.get("files", {}).items()}
+
+
+def build() -> Dict[str, Asset]:
+    """Подготовка изменившихся файлов и запись манифеста; неизменные берутся из прошлого манифеста.
+
+    Хэш исходника пересчитывается, только если изменились его время изменения или размер
+    """
+    if not os.path.isdir(FILES_DIR):
+        return {}
+
+    previous = {name: asset.to_dict() for name, asset in load().items()}
+
+    assets: Dict[str, Asset] = {}
+    manifest: Dict[str, dict] = {}
+    for source in sources():
+        source_path = os.path.join(FILES_DIR, source)
+        extension = os.path.splitext(source)[1].lower()
+
+        name = normalize_name(source)
+        if name in manifest:
+            logger.warning("Файлы %s и %s дают одно имя %s, используется первый", manifest[name]["source"], source, name)
+            continue
+
+        stat = os.stat(source_path)
+        entry = previous.get(name)
+        if (entry is None or entry.get("source") != source or entry.get("source_mtime") != stat.st_mtime_ns
+                or entry.get("source_size") != stat.st_size):
+            source_hash = _hash_file(source_path)
+            if (entry is None or entry.get("source_hash") != source_hash or entry.get("source") != source
+                    or not os.path.exists(os.path.join(FILES_DIR, entry["path"]))):
+                entry = {"source": source, "source_hash": source_hash, "path": source, "width": None, "height": None}
+                if extension in PHOTO_EXTENSIONS and Image is not None:
+                    try:
+                        entry["path"], entry["width"], entry["height"] = _optimize_photo(source_path, name)
+                    except Exception as e:
+                        logger.warning("Не удалось обработать %s, используется исходный файл: %s", source, e)
+                output_path = os.path.join(FILES_DIR, entry["path"])
+                entry["hash"] = _hash_file(output_path)
+                entry["size"] = os.path.getsize(output_path)
+            entry = {**entry, "source_mtime": stat.st_mtime_ns, "source_size": stat.st_size}
+        manifest[name] = entry
+        assets[name] = Asset(name=name, **entry)
+
+    # Свой временный файл у каждого процесса: воркеры webhook могут обновлять манифест одновременно
+    tmp_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": manifest}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+    return assets
+
+
+def check(assets: Dict[str, Asset], required: Iterable[str]) -> List[str]:
+    """Имена файлов, которые нужны боту, но отсутствуют в манифесте"""
+    return sorted({normalize_name(name) for name in required} - set(assets))
+
+
+def prepare(required: Iterable[str] = ()) -> Dict[str, Asset]:
+    """Сборка манифеста при запуске бота с предупреждением об отсутствующих файлах"""
+    if Image is None:
+        logger.warning("Pillow не установлен — изображения отправляются без пережатия: pip install Pillow")
+    assets = build()
+    missing = check(assets, [*REQUIRED_FILES, *required])
+    if missing:
+        logger.warning("В папке files/ нет файлов: %s — вместо них бот отправит только текст", ", ".join(missing))
+    logger.info("Манифест медиа: %s файлов", len(assets))
+    return assets
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for asset in prepare().values():
+        dimensions = f"{asset.width}x{asset.height}" if asset.width else "-"
+        print(f"{asset.name:24} {asset.path:32} {dimensions:>11} {asset.size:>9} {asset.hash[:12]}")
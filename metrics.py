@@ -0,0 +1,221 @@
+import bisect
+import functools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from config import METRICS_ENABLED
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Счётчик с метками в формате Prometheus"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с метками: наблюдение — один bisect и два сложения"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: счётчики корзин (последняя — +Inf), сумма и количество
+        self._values: Dict[Tuple[str, ...], list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._values.items():
+            # Корзины храним раздельно, а отдаём накопительно, как требует формат
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+REGISTRY: List[Any] = []
+
+UPDATES = Counter("bot_updates_total", "Обработанные обновления по обработчику и состоянию FSM", ("handler", "state"))
+UNHANDLED_UPDATES = Counter("bot_unhandled_updates_total", "Обновления, для которых не нашлось обработчика", ("type",))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler", "error"))
+DB_SECONDS = Histogram("bot_db_seconds", "Время выполнения функций database.py", ("function",))
+DB_ERRORS = Counter("bot_db_errors_total", "Ошибки функций database.py", ("function", "error"))
+DB_WRITE_BATCH_SECONDS = Histogram("bot_db_write_batch_seconds", "Время записи одной пачки очереди записи")
+DB_WRITE_BATCH_SIZE = Histogram("bot_db_write_batch_size", "Количество операций в одной пачке очереди записи",
+                                buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+THROTTLED = Counter("bot_throttled_updates_total", "Обновления, отброшенные защитой от флуда", ("limit",))
+API_SECONDS = Histogram("bot_api_seconds", "Время запроса к Bot API", ("method",))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки запросов к Bot API; TelegramRetryAfter — ответы 429",
+                     ("method", "error"))
+LOOP_LAG_SECONDS = Histogram("bot_loop_lag_seconds", "Задержка цикла событий относительно расписания")
+API_WAIT_SECONDS = Histogram("bot_api_wait_seconds", "Ожидание очереди отправки по полосе приоритета", ("lane",))
+API_RETRIES = Counter("bot_api_retries_total", "Повторы запросов к Bot API после 429 и ошибок сервера",
+                      ("method", "error"))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Декоратор для функций database.py; при выключенных метриках возвращает функцию как есть"""
+    if not METRICS_ENABLED:
+        return func
+
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            DB_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: время обработчика и число обновлений по обработчику и состоянию"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        UPDATES.inc(name, data.get("raw_state") or "none")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: обновления, которые не дошли ни до одного обработчика"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        result = await handler(event, data)
+        if result is UNHANDLED:
+            UNHANDLED_UPDATES.inc(event.event_type if isinstance(event, Update) else type(event).__name__)
+        return result
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки запросов к Bot API"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def setup(dispatcher, router):
+    """Подключение middleware к диспетчеру и роутеру с обработчиками"""
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware())
+    for observer in (router.message, router.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+
+
+def setup_session(session):
+    """Метрики запросов к Bot API; сессия общая для всех ботов процесса"""
+    session.middleware(RequestMetricsMiddleware())
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str, port: int):
+    """HTTP-сервер с GET /metrics для Prometheus"""
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import logging
+import re
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramNotFound, TelegramRetryAfter, TelegramUnauthorizedError
+
+import api_session
+import database as db
+import tenants
+from admin import format_lead
+from config import ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_THRESHOLD, ADMIN_DIGEST_WINDOW, OUTBOX_POLL_INTERVAL
+
+# Сколько уведомлений забирать из базы за один проход
+BATCH_SIZE = 20
+# Сводки: уведомлений за один проход и сообщений за одну сводку; остальное ждёт следующей
+DIGEST_BATCH_SIZE = 100
+DIGEST_MAX_MESSAGES = 3
+# Telegram ограничивает длину сообщения 4096 символами; запас — на заголовок сводки
+MESSAGE_LIMIT = 4096
+DIGEST_HEADER_RESERVE = 64
+DIGEST_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+# Конец обрезанного слишком длинного уведомления; запас — на него и закрывающий тег
+TRUNCATED_SUFFIX = "…"
+TRUNCATE_RESERVE = 8
+# Пауза между сообщениями сводки: в один чат Telegram принимает около сообщения в секунду
+CHAT_SEND_INTERVAL = 1.0
+# Экспоненциальная задержка между попытками: 5 с, 10 с, 20 с ... но не больше 10 минут
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+# После стольких неудачных попыток уведомление получает статус failed и остаётся в базе для разбора
+MAX_ATTEMPTS = 10
+# Ошибки Bot API, которые повтор не исправит: неверный текст или разметка, нет чата, неверный токен
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramNotFound, TelegramUnauthorizedError)
+
+logger = logging.getLogger(__name__)
+
+class _DispatcherState:
+    """Диспетчер уведомлений одного бота: у каждого свой администратор, своя очередь и свой темп"""
+
+    def __init__(self):
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # Время отправки каждого уведомления за последние ADMIN_DIGEST_WINDOW секунд (в сводке — каждого из её уведомлений)
+        self.recent: Deque[float] = collections.deque()
+        self.last_sent_at = 0.0
+
+
+_states: Dict[str, _DispatcherState] = {}
+
+
+def _state() -> _DispatcherState:
+    name = tenants.current().name
+    state = _states.get(name)
+    if state is None:
+        state = _states[name] = _DispatcherState()
+    return state
+
+
+def wake():
+    """Сигнал диспетчеру текущего бота, что в очереди появились уведомления; в других процессах ничего не делает"""
+    _state().wakeup.set()
+
+
+def _is_bursting(now: float) -> bool:
+    """Уведомления идут чаще порога — новые копятся для сводки"""
+    if ADMIN_DIGEST_THRESHOLD <= 0:
+        return False
+    recent = _state().recent
+    while recent and now - recent[0] >= ADMIN_DIGEST_WINDOW:
+        recent.popleft()
+    return len(recent) >= ADMIN_DIGEST_THRESHOLD
+
+
+def _record_sent(count: int):
+    state = _state()
+    state.last_sent_at = time.time()
+    state.recent.extend([state.last_sent_at] * count)
+
+
+def _text_length(text: str) -> int:
+    """Длина так, как её считает Telegram, — в кодовых единицах UTF-16"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _truncate(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """Текст не длиннее limit без разрезанных тегов и HTML-сущностей в конце"""
+    if _text_length(text) <= limit:
+        return text
+    # Половинка суррогатной пары на границе отбрасывается при декодировании
+    text = text.encode("utf-16-le")[:(limit - TRUNCATE_RESERVE) * 2].decode("utf-16-le", errors="ignore")
+    text = re.sub(r"<[^>]*$|&[^;\s]*$", "", text) + TRUNCATED_SUFFIX
+    if text.count("<b>") > text.count("</b>"):
+        text += "</b>"
+    return text
+
+
+def pack_digests(items: List[Tuple[int, str]], limit: int = MESSAGE_LIMIT) -> List[Tuple[List[int], str]]:
+    """Разбиение уведомлений на сообщения не длиннее limit; каждое уведомление целиком в одном сообщении.
+
+    Уведомление длиннее сообщения обрезается
+    """
+    digests = []
+    ids: List[int] = []
+    parts: List[str] = []
+    length = 0
+    separator_length = _text_length(DIGEST_SEPARATOR)
+    part_limit = limit - DIGEST_HEADER_RESERVE - separator_length
+
+    def finish():
+        if len(parts) == 1:
+            digests.append((ids, parts[0]))
+        else:
+            header = f"📬 <b>Сводка уведомлений: {len(parts)}</b>"
+            digests.append((ids, DIGEST_SEPARATOR.join([header, *parts])))
+
+    for notification_id, text in items:
+        text = _truncate(text.strip(), part_limit)
+        added = _text_length(text) + separator_length
+        if parts and length + added > limit - DIGEST_HEADER_RESERVE:
+            finish()
+            ids, parts, length = [], [], 0
+        ids.append(notification_id)
+        parts.append(text)
+        length += added
+    if parts:
+        finish()
+    return digests
+
+
+async def _fail(notification: dict, error: Exception):
+    """Уведомление больше не отправляется"""
+    logger.error("Уведомление #%s администратору не доставлено: %s", notification['id'], error)
+    await db.fail_admin_notification(notification['id'], str(error))
+
+
+async def _retry_later(notification: dict, error: Exception):
+    """Экспоненциальная задержка до следующей попытки; после MAX_ATTEMPTS попыток — отказ"""
+    if notification['attempts'] + 1 >= MAX_ATTEMPTS:
+        await _fail(notification, error)
+        return
+    delay = min(RETRY_BASE_DELAY * 2 ** notification['attempts'], RETRY_MAX_DELAY)
+    logger.warning("Ошибка отправки уведомления #%s администратору, повтор через %.0f с: %s",
+                   notification['id'], delay, error)
+    await db.reschedule_admin_notification(notification['id'], time.time() + delay, str(error))
+
+
+async def _render(notification: dict) -> str:
+    if notification['text'] is not None:
+        return _truncate(notification['text'])
+    lead = {key: notification[key] for key in ('cargo_name', 'cargo_volume', 'cargo_weight', 'delivery_method')}
+    # Лиды, сохранённые до появления готового текста в очереди
+    user_info = await db.get_user_info(notification['user_id'])
+    return _truncate(format_lead(notification['user_id'], user_info, notification['service_name'], **lead))
+
+
+async def _send(bot: Bot, notifications: List[dict], text: str, texts: Optional[Dict[int, str]] = None) -> bool:
+    """Отправка одного сообщения за одно или несколько уведомлений; при временной ошибке они остаются в очереди.
+
+    texts — тексты уведомлений сводки по id: если сводку отклонила ошибка одного из них, остальные
+    отправляются по одному и отказ получает только оно
+    """
+    try:
+        await bot.send_message(tenants.current().admin_id, text)
+    except TelegramRetryAfter as e:
+        await asyncio.gather(*(
+            db.reschedule_admin_notification(notification['id'], time.time() + e.retry_after, e.message)
+            for notification in notifications
+        ))
+        return False
+    except PERMANENT_ERRORS as e:
+        if texts is not None and len(notifications) > 1:
+            logger.warning("Сводка из %s уведомлений отклонена, отправляем по одному: %s", len(notifications), e)
+            results = []
+            for notification in notifications:
+                await asyncio.sleep(CHAT_SEND_INTERVAL)
+                results.append(await _send(bot, [notification], texts[notification['id']]))
+            return all(results)
+        for notification in notifications:
+            await _fail(notification, e)
+        return False
+    except Exception as e:
+        for notification in notifications:
+            await _retry_later(notification, e)
+        return False
+    await asyncio.gather(*(db.mark_admin_notification_sent(notification['id']) for notification in notifications))
+    _record_sent(len(notifications))
+    return True
+
+
+async def _process(bot: Bot, notification: dict):
+    try:
+        text = await _render(notification)
+    except Exception as e:
+        await _retry_later(notification, e)
+        return
+    await _send(bot, [notification], text)
+
+
+async def _process_digest(bot: Bot, notifications: List[dict]):
+    """Сводка из накопленных уведомлений: не больше DIGEST_MAX_MESSAGES сообщений, остальное — в следующий раз"""
+    by_id = {notification['id']: notification for notification in notifications}
+    items = []
+    for notification in notifications:
+        try:
+            items.append((notification['id'], await _render(notification)))
+        except Exception as e:
+            await _retry_later(notification, e)
+
+    texts = dict(items)
+    for index, (ids, text) in enumerate(pack_digests(items)[:DIGEST_MAX_MESSAGES]):
+        if index:
+            await asyncio.sleep(CHAT_SEND_INTERVAL)
+        if not await _send(bot, [by_id[notification_id] for notification_id in ids], text, texts):
+            break
+
+
+async def run_dispatcher(bot: Bot):
+    """Фоновая доставка уведомлений из admin_outbox с повторами; при всплеске — сводками"""
+    state = _state()
+    while True:
+        state.wakeup.clear()
+        now = time.time()
+        if _is_bursting(now):
+            delay = state.last_sent_at + ADMIN_DIGEST_INTERVAL - now
+            if delay > 0:
+                # Пока ждём, уведомления копятся в базе и попадут в сводку
+                await asyncio.sleep(delay)
+                continue
+            notifications = await db.get_due_admin_notifications(now, DIGEST_BATCH_SIZE)
+            await _process_digest(bot, notifications)
+        else:
+            notifications = await db.get_due_admin_notifications(now, BATCH_SIZE)
+            for index, notification in enumerate(notifications):
+                await _process(bot, notification)
+                if index + 1 < len(notifications) and _is_bursting(time.time()):
+                    # Оставшиеся уведомления уйдут сводкой
+                    break
+            if len(notifications) == BATCH_SIZE:
+                continue
+
+        next_attempt_at = await db.get_next_admin_notification_time()
+        timeout = OUTBOX_POLL_INTERVAL
+        if next_attempt_at is not None:
+            timeout = min(max(next_attempt_at - time.time(), 0), OUTBOX_POLL_INTERVAL)
+        try:
+            await asyncio.wait_for(state.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start(bot: Bot):
+    """Диспетчер уведомлений текущего бота; задача наследует бота из контекста"""
+    state = _state()
+    if state.task is None:
+        # Уведомления уступают очередь ответам пользователям
+        with api_session.lane(api_session.ADMIN):
+            state.task = asyncio.create_task(run_dispatcher(bot))
+
+
+async def stop():
+    state = _state()
+    if state.task is not None:
+        state.task.cancel()
+        await asyncio.gather(state.task, return_exceptions=True)
+        state.task = None
@@ -0,0 +1,210 @@
+import asyncio
+import cProfile
+import collections
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import TelegramObject
+
+import metrics
+from config import LOOP_LAG_THRESHOLD, METRICS_ENABLED
+
+# Профилирование по команде /profile: не дольше PROFILE_MAX_SECONDS, стеки снимаются каждые SAMPLE_INTERVAL секунд
+PROFILE_MAX_SECONDS = 120
+SAMPLE_INTERVAL = 0.005
+# Сторож цикла событий: как часто цикл отмечается и сколько кадров стека писать в лог
+LAG_CHECK_INTERVAL = 0.1
+LAG_STACK_DEPTH = 15
+
+logger = logging.getLogger(__name__)
+
+_running = False
+
+# Обработчик, который выполняет задача, — чтобы сторож мог назвать его по задаче, занявшей цикл
+_task_handlers: Dict[asyncio.Task, str] = {}
+
+
+def is_running() -> bool:
+    return _running
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _collapse(frame) -> str:
+    """Стек в одну строку от корня к текущему кадру, как в формате collapsed stacks"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> collections.Counter:
+    """Сэмплы стеков всех потоков процесса, кроме вызывающего; ключ — поток и стек"""
+    own = threading.get_ident()
+    counts: collections.Counter = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                counts[names.get(ident, str(ident)) + ";" + _collapse(frame)] += 1
+        time.sleep(interval)
+    return counts
+
+
+def start(seconds: float, mode: str = "stacks") -> "asyncio.Task[str]":
+    """Запуск профилирования; флаг ставится сразу, поэтому второй вызов до завершения первого — RuntimeError.
+
+    Задача возвращает путь к временному файлу профиля, удаляет его вызывающий
+    """
+    global _running
+    if _running:
+        raise RuntimeError("Профилирование уже выполняется")
+    _running = True
+    try:
+        return asyncio.create_task(_profile(seconds, mode))
+    except BaseException:
+        _running = False
+        raise
+
+
+async def profile(seconds: float, mode: str = "stacks") -> str:
+    """Профиль процесса за seconds секунд во временном файле; путь удаляет вызывающий.
+
+    stacks — сэмплы стеков всех потоков (цикл событий и потоки SQLite) для flamegraph.pl или speedscope,
+    pstats — cProfile потока цикла событий для snakeviz или python -m pstats
+    """
+    return await start(seconds, mode)
+
+
+async def _profile(seconds: float, mode: str) -> str:
+    global _running
+    try:
+        seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+        if mode == "pstats":
+            fd, path = tempfile.mkstemp(suffix=".pstats")
+            os.close(fd)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            profiler.dump_stats(path)
+            return path
+
+        counts = await asyncio.to_thread(sample_stacks, seconds)
+        fd, path = tempfile.mkstemp(suffix=".folded")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+    finally:
+        _running = False
+
+
+def _describe(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "обратный вызов цикла событий"
+    handler = _task_handlers.get(task)
+    if handler is not None:
+        return f"обработчик {handler}"
+    return f"задача {task.get_name()} ({getattr(task.get_coro(), '__qualname__', '?')})"
+
+
+class LoopWatchdog:
+    """Поток, который замечает блокировку цикла событий и пишет в лог, что в это время выполнялось"""
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LAG_CHECK_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._last_beat = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def _beat(self):
+        now = time.monotonic()
+        if METRICS_ENABLED:
+            metrics.LOOP_LAG_SECONDS.observe(max(0.0, now - self._last_beat - self.interval))
+        self._last_beat = now
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            lag = time.monotonic() - last_beat - self.interval
+            # О каждой блокировке пишем один раз, пока она не закончится
+            if lag < self.threshold or reported == last_beat:
+                continue
+            reported = last_beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame, LAG_STACK_DEPTH)) if frame is not None else ""
+            logger.warning("Цикл событий заблокирован уже %.0f мс, выполняется %s:\n%s",
+                           lag * 1000, _describe(asyncio.current_task(self._loop)), stack)
+
+
+class HandlerTaskMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: запоминает, какой обработчик выполняет текущая задача"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        task = asyncio.current_task()
+        handler_object = data.get("handler")
+        _task_handlers[task] = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        try:
+            return await handler(event, data)
+        finally:
+            _task_handlers.pop(task, None)
+
+
+_watchdog: Optional[LoopWatchdog] = None
+
+
+def start_watchdog():
+    global _watchdog
+    if LOOP_LAG_THRESHOLD > 0 and _watchdog is None:
+        _watchdog = LoopWatchdog()
+        _watchdog.start()
+
+
+def stop_watchdog():
+    global _watchdog
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
+
+
+def setup(router: Router):
+    if LOOP_LAG_THRESHOLD <= 0:
+        return
+    middleware = HandlerTaskMiddleware()
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
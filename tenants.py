@@ -0,0 +1,117 @@
+import contextvars
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (ADMIN_ID, BOT_TOKEN, COURSE_POST_LINK, REVIEWS_CHANNEL, SOCIAL_LINKS, TENANTS_FILE,
+                    WEBSITE_LINK, WRITE_BATCH_DELAY, WRITE_BATCH_SIZE, YANDEX_MAPS_LINK)
+from db_pool import ConnectionPool, WriteQueue
+
+# Ссылки бренда: подставляются в тексты content.json как {REVIEWS_CHANNEL} и в кнопки keyboards.py
+DEFAULT_LINKS = {
+    "REVIEWS_CHANNEL": REVIEWS_CHANNEL,
+    "COURSE_POST_LINK": COURSE_POST_LINK,
+    "YANDEX_MAPS_LINK": YANDEX_MAPS_LINK,
+    "WEBSITE_LINK": WEBSITE_LINK,
+    "SOCIAL_LINKS": SOCIAL_LINKS,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant:
+    """Бот одного бренда: свой токен, администратор, база, каталог и ссылки.
+
+    Цикл событий, HTTP-сессия и кэши в памяти общие для всех ботов процесса.
+    """
+
+    def __init__(self, name: str, token: Optional[str], admin_id: int, database: Optional[str] = None,
+                 content: Optional[str] = None, links: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.token = token
+        self.admin_id = admin_id
+        # None — пути по умолчанию: database.DATABASE_PATH и content.CONTENT_PATH
+        self.database_path = database
+        self.content_path = content
+        self.links = {**DEFAULT_LINKS, **(links or {})}
+        self.pool = ConnectionPool()
+        self.write_queue = WriteQueue(self.pool, max_delay=WRITE_BATCH_DELAY, max_batch=WRITE_BATCH_SIZE)
+
+    @property
+    def bot_id(self) -> Optional[int]:
+        """id бота — число до двоеточия в токене, как Bot.id в aiogram"""
+        return int(self.token.split(":", 1)[0]) if self.token else None
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+
+# Единственный бот из BOT_TOKEN и ADMIN_ID; он же действует вне обновлений, если TENANTS_FILE не задан
+DEFAULT = Tenant("default", BOT_TOKEN, ADMIN_ID)
+
+_current: contextvars.ContextVar[Tenant] = contextvars.ContextVar("tenant", default=DEFAULT)
+_tenants: List[Tenant] = [DEFAULT]
+_by_bot_id: Dict[int, Tenant] = {}
+
+
+def load(path: str = TENANTS_FILE) -> List[Tenant]:
+    """Боты из файла TENANTS_FILE; без файла — один бот по умолчанию"""
+    global _tenants
+    if not path:
+        tenants = [DEFAULT]
+    else:
+        with open(path, encoding="utf-8") as f:
+            raw = json.load(f)
+        tenants = []
+        for entry in raw["tenants"]:
+            entry = dict(entry)
+            name = entry.pop("name")
+            entry.setdefault("database", f"bot_{name}.db")
+            tenants.append(Tenant(name, **entry))
+        names = [tenant.name for tenant in tenants]
+        if not tenants or len(set(names)) != len(names) or not all(tenant.token for tenant in tenants):
+            raise RuntimeError(f"В {path} нужны боты с уникальными name и заданными token")
+        logger.info("Боты из %s: %s", path, ", ".join(names))
+
+    _tenants = tenants
+    _by_bot_id.clear()
+    _by_bot_id.update({tenant.bot_id: tenant for tenant in tenants if tenant.bot_id is not None})
+    return tenants
+
+
+def all_tenants() -> List[Tenant]:
+    return list(_tenants)
+
+
+def current() -> Tenant:
+    """Бот, чьё обновление или фоновая задача сейчас выполняется"""
+    return _current.get()
+
+
+def for_bot(bot: Bot) -> Tenant:
+    return _by_bot_id.get(bot.id, current())
+
+
+@contextmanager
+def activate(tenant: Tenant) -> Iterator[Tenant]:
+    """Выполнение блока от имени бота; задачи, созданные внутри, наследуют его"""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+class TenantDispatcher(Dispatcher):
+    """Диспетчер, который обрабатывает каждое обновление от имени бота, получившего его.
+
+    Бот выбирается до всех middleware, включая FSM: состояние читается уже из базы этого бота.
+    """
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        with activate(for_bot(bot)):
+            return await super().feed_update(bot, update, **kwargs)
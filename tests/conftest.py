@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+import tenants  # noqa: E402
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """Запуск корутины от имени отдельного бота со своей временной базой"""
+    def run(make_coro):
+        async def main():
+            tenant = tenants.Tenant("test", None, 0, database=str(tmp_path / "bot.db"))
+            with tenants.activate(tenant):
+                await db.init_db()
+                try:
+                    return await make_coro()
+                finally:
+                    await db.close_db()
+
+        db.user_cache.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            db.user_cache.clear()
+    return run
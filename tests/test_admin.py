@@ -0,0 +1,17 @@
+from admin import format_lead
+
+
+def test_format_lead_escapes_user_input():
+    user_info = {'username': 'u', 'first_name': '<Иван>', 'last_name': 'A&B', 'phone_number': '+7'}
+    text = format_lead(1, user_info, 'Доставка', cargo_name='<script>', cargo_weight='10 < 20')
+    assert '&lt;Иван&gt;' in text
+    assert 'A&amp;B' in text
+    assert '&lt;script&gt;' in text
+    assert '10 &lt; 20' in text
+    assert '<script>' not in text
+
+
+def test_format_lead_without_user_info():
+    text = format_lead(1, None, 'Доставка')
+    assert 'не указано' in text
+    assert '@не указан' in text
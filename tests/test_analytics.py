@@ -0,0 +1,37 @@
+import asyncio
+
+import analytics
+import tenants
+
+
+def test_failed_flush_returns_events_to_buffer(monkeypatch):
+    tenant = tenants.Tenant("test", None, 0)
+    written = []
+
+    async def fail(events):
+        # Пока пачка пишется, приходят новые события
+        analytics.track(1, analytics.CLICK, "c")
+        analytics.track(1, analytics.CLICK, "d")
+        raise RuntimeError("database is locked")
+
+    async def write(events):
+        written.extend(events)
+
+    monkeypatch.setattr(tenants, "all_tenants", lambda: [tenant])
+    monkeypatch.setattr(analytics, "ANALYTICS_BUFFER_SIZE", 3)
+    monkeypatch.setattr(analytics, "_buffers", {})
+    monkeypatch.setattr(analytics, "_dropped", 0)
+
+    with tenants.activate(tenant):
+        analytics.track(1, analytics.CLICK, "a")
+        analytics.track(1, analytics.CLICK, "b")
+        monkeypatch.setattr(analytics.db, "add_analytics_events", fail)
+        asyncio.run(analytics.flush())
+        # В буфер на три события к двум новым влезает только самое свежее из пачки
+        assert analytics._dropped == 1
+
+        monkeypatch.setattr(analytics.db, "add_analytics_events", write)
+        asyncio.run(analytics.flush())
+
+    assert [event[3] for event in written] == ["b", "c", "d"]
+    assert not analytics._buffers["test"]
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from aiogram.methods import SendMessage
+
+import api_session
+from api_session import ADMIN, BROADCAST, INTERACTIVE, ChatLimiter, PriorityLimiter, SchedulerMiddleware
+
+
+class FakeBot:
+    id = 1
+
+
+def test_priority_limiter_serves_lanes_in_order():
+    async def scenario():
+        limiter = PriorityLimiter(rate=100, capacity=1)
+        await limiter.acquire(BROADCAST)
+        order = []
+
+        async def request(priority, name):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        await asyncio.gather(request(BROADCAST, "b1"), request(BROADCAST, "b2"),
+                             request(ADMIN, "a"), request(INTERACTIVE, "i"))
+        return order
+
+    assert asyncio.run(scenario()) == ["i", "a", "b1", "b2"]
+
+
+def test_priority_limiter_spend_does_not_wait_but_delays_queue():
+    async def scenario():
+        limiter = PriorityLimiter(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(3):
+            await limiter.spend()
+        spent = time.monotonic() - start
+        await limiter.acquire(BROADCAST)
+        return spent, time.monotonic() - start
+
+    spent, waited = asyncio.run(scenario())
+    assert spent < 0.04
+    # Два токена запаса и один в долг: рассылка ждёт, пока долг погасится и накопится свой токен — 2 / 20 с
+    assert waited >= 0.09
+
+
+def test_priority_limiter_spend_waits_at_debt_limit():
+    async def scenario():
+        limiter = PriorityLimiter(rate=20, capacity=2)
+        start = time.monotonic()
+        # Запас 2 и долг до 2: четыре ответа сразу, пятый ждёт токен
+        for _ in range(4):
+            await limiter.spend()
+        burst = time.monotonic() - start
+        await limiter.spend()
+        return burst, time.monotonic() - start, limiter._tokens
+
+    burst, total, tokens = asyncio.run(scenario())
+    assert burst < 0.04
+    assert total >= 0.04
+    assert tokens >= -2
+
+
+def test_chat_limiter_reserves_burst_then_spaces_requests(monkeypatch):
+    monkeypatch.setattr(api_session.time, "monotonic", lambda: 1000.0)
+    limiter = ChatLimiter(rate=1, capacity=2)
+    assert [limiter.reserve("chat") for _ in range(4)] == [0.0, 0.0, 1.0, 2.0]
+    assert limiter.reserve("other") == 0.0
+
+
+def test_chat_limiter_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(api_session.time, "monotonic", lambda: now[0])
+    limiter = ChatLimiter(rate=1, capacity=1)
+    assert limiter.reserve("chat") == 0.0
+    now[0] += 1
+    assert limiter.reserve("chat") == 0.0
+
+
+def test_interactive_replies_skip_chat_limit():
+    async def make_request(bot, method):
+        return method.text
+
+    async def send(scheduler, count):
+        start = time.monotonic()
+        for _ in range(count):
+            await scheduler(make_request, FakeBot(), SendMessage(chat_id=5, text="x"))
+        return time.monotonic() - start
+
+    async def scenario():
+        scheduler = SchedulerMiddleware(rate=1000, chat_rate=10, chat_burst=1)
+        interactive = await send(scheduler, 3)
+        with api_session.lane(ADMIN):
+            admin = await send(scheduler, 3)
+        return interactive, admin
+
+    interactive, admin = asyncio.run(scenario())
+    assert interactive < 0.05
+    assert admin >= 0.15
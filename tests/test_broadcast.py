@@ -0,0 +1,40 @@
+import asyncio
+import types
+
+import broadcast
+import database as db
+
+
+class FakeBot:
+    def __init__(self):
+        self.copied = []
+
+    async def send_message(self, chat_id, text):
+        return types.SimpleNamespace(message_id=1)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        pass
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.copied.append(chat_id)
+
+
+def test_broadcast_finishes_when_status_write_fails(run_db, monkeypatch):
+    async def failing_status(job_id, user_id, status, error):
+        raise RuntimeError("database is locked")
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await db.add_user(user_id, wait=True)
+        monkeypatch.setattr(db, "set_broadcast_recipient_status", failing_status)
+        payload = broadcast.BroadcastPayload(1000, [1])
+        job_id = await db.create_broadcast_job(payload.to_json(), 1000)
+        bot = FakeBot()
+        # Раньше каждая ошибка завершала воркер, и queue.join() ждал вечно
+        stats = await asyncio.wait_for(
+            broadcast.run_broadcast(bot, job_id, 0, payload, 1000, workers=2, fill_cursor=0), 5)
+        return bot.copied, stats
+
+    copied, stats = run_db(scenario)
+    assert sorted(copied) == [1, 2, 3]
+    assert stats.sent == 3
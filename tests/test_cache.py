@@ -0,0 +1,62 @@
+from cache import MISSING, TTLCache
+
+
+def test_get_returns_missing_and_counts_miss():
+    cache = TTLCache(10, 60)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_none_is_not_missing():
+    cache = TTLCache(10, 60)
+    cache.set("a", None)
+    assert cache.get("a") is None
+    assert "a" in cache
+    assert cache.stats()["hits"] == 1
+
+
+def test_get_without_count_keeps_stats():
+    cache = TTLCache(10, 60)
+    cache.set("a", 1)
+    cache.get("a", count=False)
+    cache.get("b", count=False)
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 0
+
+
+def test_lru_eviction():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(10, 5)
+    cache.set("a", 1)
+    now[0] += 4
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_zero_size_disables_cache():
+    cache = TTLCache(0, 60)
+    cache.set("a", 1)
+    assert cache.get("a") is MISSING
+
+
+def test_hit_rate():
+    cache = TTLCache(10, 60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats()["hit_rate"] == 0.5
@@ -0,0 +1,89 @@
+import asyncio
+
+import database as db
+from cache import MISSING
+
+
+def test_update_contact_on_cache_miss(run_db):
+    async def scenario():
+        await db.add_user(1, "user", "Иван", None, wait=True)
+        db.user_cache.clear()
+        # Строки нет в кэше: обновление не должно принимать MISSING за закэшированную строку
+        await db.update_user_contact(1, "+79990000000")
+        return await db.get_user(1)
+
+    user = run_db(scenario)
+    assert user["phone_number"] == "+79990000000"
+    assert user["contact_shared"]
+
+
+def test_update_contact_updates_cached_row(run_db):
+    async def scenario():
+        await db.add_user(1, "user", "Иван", None, wait=True)
+        await db.get_user(1)
+        await db.update_user_contact(1, "+79990000000")
+        return db.user_cache.get(db._user_key(1), count=False)
+
+    user = run_db(scenario)
+    assert user["phone_number"] == "+79990000000"
+    assert user["contact_shared"]
+
+
+def test_failed_add_user_is_evicted_from_cache(run_db, monkeypatch):
+    monkeypatch.setattr(db, "_INSERT_USER_SQL", "INSERT INTO missing_table VALUES (?, ?, ?, ?)")
+
+    async def scenario():
+        # Пользователь, которого нет в базе, кэшируется как None, и add_user заменяет его новой строкой
+        await db.get_user(1)
+        await db.add_user(1, "user", "Иван", None)
+        cached = db.user_cache.get(db._user_key(1), count=False)
+        await db.flush_writes()
+        # Колбэк future выполняется на следующей итерации цикла
+        await asyncio.sleep(0)
+        return cached, db.user_cache.get(db._user_key(1), count=False)
+
+    cached, after_failure = run_db(scenario)
+    assert cached["first_name"] == "Иван"
+    assert after_failure is MISSING
+
+
+async def _recount() -> dict:
+    """Те же показатели полным просмотром users и leads"""
+    async with db._pool().reader() as conn:
+        rows = await conn.execute_fetchall("""
+            SELECT (SELECT COUNT(*) FROM users),
+                   (SELECT COUNT(*) FROM users WHERE is_active IS TRUE),
+                   (SELECT COUNT(*) FROM users WHERE contact_shared IS TRUE),
+                   (SELECT COUNT(DISTINCT user_id) FROM leads),
+                   (SELECT COUNT(*) FROM leads)
+        """)
+    return dict(zip(('users_total', 'users_active', 'users_contact', 'users_with_leads', 'leads_total'), rows[0]))
+
+
+def test_trigger_counters_follow_writes(run_db):
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await db.add_user(user_id, wait=True)
+        # Повторный /start не создаёт второго пользователя
+        await db.add_user(1, wait=True)
+        await db.update_user_contact(1, "+79990000001")
+        await db.update_user_contact(1, "+79990000002")
+        await db.update_user_contact(2, "+79990000003")
+        await db.add_lead(1, "Доставка грузов")
+        await db.add_lead(1, "Перевод денег")
+        await db.add_lead(2, "Доставка грузов")
+        job_id = await db.create_broadcast_job("{}", 0)
+        await db.add_broadcast_recipients(job_id, [3])
+        await db.set_broadcast_recipient_status(job_id, 3, 'blocked')
+        blocked = await db.get_stats()
+        # Пользователь снова написал боту — он опять активен
+        await db.add_user(3, wait=True)
+        return blocked, await db.get_stats(), await _recount()
+
+    blocked, stats, recount = run_db(scenario)
+    assert blocked['users_active'] == 2
+    assert {key: stats[key] for key in recount} == recount == {
+        'users_total': 3, 'users_active': 3, 'users_contact': 2, 'users_with_leads': 2, 'leads_total': 3,
+    }
+    assert sorted(stats['leads_by_service']) == [("Доставка грузов", 2), ("Перевод денег", 1)]
+    assert sum(count for _, count in stats['leads_by_day']) == 3
@@ -0,0 +1,31 @@
+import asyncio
+
+from db_pool import ConnectionPool, WriteQueue
+
+
+def test_cancelled_batch_fails_pending_futures(tmp_path):
+    async def scenario():
+        pool = ConnectionPool()
+        await pool.open(str(tmp_path / "bot.db"), readers=1)
+        try:
+            queue = WriteQueue(pool)
+            queue.start()
+            started = asyncio.Event()
+
+            async def hang(conn):
+                started.set()
+                await asyncio.Event().wait()
+
+            futures = [queue.submit(hang), queue.submit("CREATE TABLE t (x INTEGER)")]
+            await started.wait()
+            # Пришло уже после того, как пачка собрана, и ждёт в очереди
+            futures.append(queue.submit("CREATE TABLE u (x INTEGER)"))
+            queue._task.cancel()
+            return await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+        finally:
+            await pool.close()
+
+    results = asyncio.run(scenario())
+    assert len(results) == 3
+    for result in results:
+        assert isinstance(result, RuntimeError)
@@ -0,0 +1,39 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import database as db
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+
+def test_state_survives_cache_loss(run_db):
+    async def scenario():
+        storage = SQLiteStorage()
+        await storage.set_state(KEY, "Form:name")
+        await storage.set_data(KEY, {"name": "Иван"})
+        await db.flush_writes()
+        storage._cache.clear()
+        return await storage.get_state(KEY), await storage.get_data(KEY)
+
+    assert run_db(scenario) == ("Form:name", {"name": "Иван"})
+
+
+def test_failed_write_is_evicted_from_cache(run_db):
+    async def scenario():
+        storage = SQLiteStorage()
+        await storage.set_state(KEY, "Form:name")
+        await db.flush_writes()
+        await db._write_queue().submit("DROP TABLE fsm_storage")
+        await storage.set_state(KEY, "Form:phone")
+        cached = await storage.get_state(KEY)
+        await db.flush_writes()
+        # Колбэк future выполняется на следующей итерации цикла
+        await asyncio.sleep(0)
+        return cached, len(storage._cache)
+
+    cached, cache_size = run_db(scenario)
+    assert cached == "Form:phone"
+    # Следующее чтение пойдёт в базу, а не отдаст несохранённое состояние
+    assert cache_size == 0
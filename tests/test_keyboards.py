@@ -0,0 +1,66 @@
+import copy
+
+import pytest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from pydantic import ValidationError
+
+import keyboards as kb
+import tenants
+
+
+class FakeBot:
+    parse_mode = None
+    disable_web_page_preview = None
+    protect_content = None
+
+
+def form_fields(markup):
+    form = AiohttpSession().build_form_data(FakeBot(), SendMessage(chat_id=1, text="x", reply_markup=markup))
+    return [(field[0]["name"], field[2]) for field in form._fields]
+
+
+def unfrozen(build, *args):
+    # Та же функция построения без заморозки
+    original = kb._freeze
+    kb._freeze = lambda markup: markup
+    try:
+        return build(*args)
+    finally:
+        kb._freeze = original
+
+
+@pytest.mark.parametrize("name", sorted(kb.MARKUPS))
+def test_shared_markups_are_read_only(name):
+    markup = kb.MARKUPS[name]
+    with pytest.raises(ValidationError):
+        markup.resize_keyboard = False
+    with pytest.raises(TypeError):
+        markup.keyboard.append([])
+    with pytest.raises(TypeError):
+        markup.keyboard[0].pop()
+    with pytest.raises(ValidationError):
+        markup.keyboard[0][0].text = "другая"
+
+
+def test_tenant_markups_are_read_only():
+    markup = kb._build_tenant_markup(tenants.DEFAULT, "about_us_inline")
+    with pytest.raises(TypeError):
+        markup.inline_keyboard[0].append(None)
+    with pytest.raises(ValidationError):
+        markup.inline_keyboard[0][0].url = "https://example.com"
+
+
+def test_frozen_markup_is_sent_unchanged():
+    assert form_fields(kb.get_main_menu()) == form_fields(unfrozen(kb._build_main_menu))
+    assert form_fields(kb._build_service_action(tenants.DEFAULT, "Перевод денег")) == \
+        form_fields(unfrozen(kb._build_service_action.__wrapped__, tenants.DEFAULT, "Перевод денег"))
+
+
+def test_copy_and_builder_are_mutable():
+    markup = copy.deepcopy(kb.get_main_menu())
+    markup.keyboard.append([])
+    builder = InlineKeyboardBuilder.from_markup(kb._build_tenant_markup(tenants.DEFAULT, "social_networks"))
+    builder.button(text="ещё", callback_data="more")
+    assert len(list(builder.buttons)) == 5
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+import pytest
+
+import media_cache
+import media_manifest
+
+
+@pytest.fixture
+def files_dir(tmp_path, monkeypatch):
+    """Пустая папка files/ и сброшенный манифест в памяти"""
+    monkeypatch.setattr(media_manifest, "FILES_DIR", str(tmp_path))
+    monkeypatch.setattr(media_manifest, "OPTIMIZED_DIR", str(tmp_path / "optimized"))
+    monkeypatch.setattr(media_manifest, "MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(media_cache, "_assets", None)
+    monkeypatch.setattr(media_cache, "_sources", None)
+    monkeypatch.setattr(media_cache, "_manifest_version", None)
+    return tmp_path
+
+
+def write(path, data):
+    path.write_bytes(data)
+    # Отметка времени заведомо отличается от прошлой записи того же файла
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_build_records_source_stat(files_dir):
+    write(files_dir / "Guide.PDF", b"v1")
+    assets = media_manifest.build()
+    asset = assets["guide.pdf"]
+    stat = (files_dir / "Guide.PDF").stat()
+    assert (asset.source_mtime, asset.source_size) == (stat.st_mtime_ns, stat.st_size)
+    assert media_manifest.load()["guide.pdf"].source_mtime == stat.st_mtime_ns
+    assert not media_manifest.is_stale(asset)
+
+
+def refresh(rebuild=True):
+    return asyncio.run(media_cache.refresh(rebuild))
+
+
+def test_lookup_does_not_touch_disk(files_dir, monkeypatch):
+    write(files_dir / "guide.pdf", b"v1")
+    media_cache.prepare()
+    monkeypatch.setattr(media_manifest, "build", lambda: pytest.fail("сборка на пути отправки"))
+    monkeypatch.setattr(media_manifest, "is_stale", lambda asset: pytest.fail("stat на пути отправки"))
+    write(files_dir / "guide.pdf", b"version 2")
+    write(files_dir / "price.pdf", b"new")
+    assert media_cache.get_asset("guide.pdf").size == 2
+    assert not media_cache.exists("price.pdf")
+
+
+def test_refresh_without_changes_keeps_manifest(files_dir):
+    write(files_dir / "guide.pdf", b"v1")
+    assets = media_cache.prepare()
+    assert not refresh()
+    assert media_cache._get_assets() is assets
+
+
+def test_replaced_file_gets_new_hash(files_dir):
+    write(files_dir / "guide.pdf", b"v1")
+    media_cache.prepare()
+    old_hash = media_cache.get_asset("guide.pdf").hash
+    write(files_dir / "guide.pdf", b"version 2")
+    assert refresh()
+    asset = media_cache.get_asset("guide.pdf")
+    assert asset.hash != old_hash
+    assert asset.size == len(b"version 2")
+
+
+def test_new_file_found_without_restart(files_dir):
+    media_cache.prepare()
+    assert not media_cache.exists("price.pdf")
+    write(files_dir / "price.pdf", b"new")
+    refresh()
+    assert media_cache.exists("price.pdf")
+
+
+def test_deleted_file_disappears(files_dir):
+    write(files_dir / "guide.pdf", b"v1")
+    media_cache.prepare()
+    (files_dir / "guide.pdf").unlink()
+    refresh()
+    assert media_cache.get_asset("guide.pdf") is None
+
+
+def test_other_worker_rereads_manifest(files_dir):
+    write(files_dir / "guide.pdf", b"v1")
+    media_cache.prepare()
+    write(files_dir / "price.pdf", b"new")
+    # Нерабочий процесс не собирает манифест сам
+    assert not refresh(rebuild=False)
+    media_manifest.build()
+    assert refresh(rebuild=False)
+    assert media_cache.exists("price.pdf")
@@ -0,0 +1,66 @@
+import asyncio
+import sqlite3
+
+import database as db
+import tenants
+
+
+def init_and_close(path):
+    async def main():
+        with tenants.activate(tenants.Tenant("test", None, 0, database=path)):
+            await db.init_db()
+            try:
+                return await db.get_stats()
+            finally:
+                await db.close_db()
+    return asyncio.run(main())
+
+
+def schema(path):
+    with sqlite3.connect(path) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    return version, names
+
+
+def test_new_database_gets_all_migrations(tmp_path):
+    path = str(tmp_path / "bot.db")
+    init_and_close(path)
+    version, names = schema(path)
+    assert version == len(db.MIGRATIONS)
+    assert {"idx_leads_user_id", "idx_leads_created_at", "idx_leads_service_name",
+            "idx_users_contact_shared", "analytics_events", "analytics_hourly", "analytics_daily"} <= names
+
+
+def test_repeated_init_is_idempotent(tmp_path):
+    path = str(tmp_path / "bot.db")
+    init_and_close(path)
+    first = schema(path)
+    init_and_close(path)
+    assert schema(path) == first
+
+
+def test_existing_database_is_migrated_with_counters(tmp_path):
+    # База версии 0: только users и leads с данными, без счётчиков и индексов
+    path = str(tmp_path / "bot.db")
+    with sqlite3.connect(path) as conn:
+        conn.executescript("""
+            CREATE TABLE users (
+                user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT,
+                phone_number TEXT, contact_shared BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE leads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, service_name TEXT,
+                cargo_name TEXT, cargo_volume TEXT, cargo_weight TEXT, delivery_method TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO users (user_id, contact_shared) VALUES (1, TRUE), (2, FALSE), (3, FALSE);
+            INSERT INTO leads (user_id, service_name) VALUES (1, 'Доставка грузов'), (1, NULL), (2, 'Доставка грузов');
+        """)
+
+    stats = init_and_close(path)
+    assert schema(path)[0] == len(db.MIGRATIONS)
+    assert (stats['users_total'], stats['users_active'], stats['users_contact']) == (3, 3, 1)
+    assert (stats['users_with_leads'], stats['leads_total']) == (2, 3)
+    assert sorted(stats['leads_by_service']) == [("", 1), ("Доставка грузов", 2)]
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.methods import SendMessage
+
+import outbox
+from outbox import MESSAGE_LIMIT, pack_digests
+
+
+class FakeBot:
+    """Бот, который записывает отправленные тексты; текст, содержащий ключ errors, вызывает его ошибку"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        for marker, error in self.errors.items():
+            if marker in text:
+                raise error
+        self.sent.append(text)
+
+
+@pytest.fixture
+def outbox_db(monkeypatch):
+    """Записи о доставке вместо обращений к базе"""
+    calls = {"sent": [], "failed": [], "rescheduled": []}
+
+    async def mark_sent(notification_id):
+        calls["sent"].append(notification_id)
+
+    async def fail(notification_id, error):
+        calls["failed"].append(notification_id)
+
+    async def reschedule(notification_id, next_attempt_at, error):
+        calls["rescheduled"].append(notification_id)
+
+    monkeypatch.setattr(outbox.db, "mark_admin_notification_sent", mark_sent)
+    monkeypatch.setattr(outbox.db, "fail_admin_notification", fail)
+    monkeypatch.setattr(outbox.db, "reschedule_admin_notification", reschedule)
+    monkeypatch.setattr(outbox, "CHAT_SEND_INTERVAL", 0)
+    return calls
+
+
+def bad_request(text):
+    return TelegramBadRequest(SendMessage(chat_id=1, text=text), "Bad Request: can't parse entities")
+
+
+def notification(notification_id, text, attempts=0):
+    return {'id': notification_id, 'text': text, 'attempts': attempts}
+
+
+def test_permanent_error_fails_without_retry(outbox_db):
+    bot = FakeBot({"a": bad_request("a")})
+    asyncio.run(outbox._process(bot, notification(1, "a")))
+    assert outbox_db == {"sent": [], "failed": [1], "rescheduled": []}
+
+
+def test_transient_error_is_retried(outbox_db):
+    bot = FakeBot({"a": TelegramNetworkError(SendMessage(chat_id=1, text="a"), "connection reset")})
+    asyncio.run(outbox._process(bot, notification(1, "a")))
+    assert outbox_db == {"sent": [], "failed": [], "rescheduled": [1]}
+
+
+def test_attempts_are_capped(outbox_db):
+    bot = FakeBot({"a": TelegramNetworkError(SendMessage(chat_id=1, text="a"), "connection reset")})
+    asyncio.run(outbox._process(bot, notification(1, "a", attempts=outbox.MAX_ATTEMPTS - 1)))
+    assert outbox_db == {"sent": [], "failed": [1], "rescheduled": []}
+
+
+def test_pack_single_notification_without_header():
+    assert pack_digests([(1, " текст ")]) == [([1], "текст")]
+
+
+def test_pack_joins_notifications_under_header():
+    [(ids, text)] = pack_digests([(1, "a"), (2, "b")])
+    assert ids == [1, 2]
+    assert text.startswith("📬 <b>Сводка уведомлений: 2</b>")
+    assert text.endswith("a" + outbox.DIGEST_SEPARATOR + "b")
+
+
+def test_pack_respects_limit_and_keeps_notifications_whole():
+    items = [(index, f"{index}:" + "я" * 300) for index in range(40)]
+    digests = pack_digests(items, limit=1000)
+    assert len(digests) > 1
+    assert [notification_id for ids, _ in digests for notification_id in ids] == list(range(40))
+    for ids, text in digests:
+        assert outbox._text_length(text) <= 1000
+        for notification_id in ids:
+            assert f"{notification_id}:" + "я" * 300 in text
+
+
+def test_pack_counts_utf16_length():
+    # Эмодзи занимает две кодовые единицы UTF-16
+    digests = pack_digests([(1, "🔥" * 300), (2, "🔥" * 300)], limit=1000)
+    assert [ids for ids, _ in digests] == [[1], [2]]
+
+
+def test_pack_truncates_oversized_notification():
+    text = "<b>Лид</b> " + "x &amp; y " * 1000
+    [(ids, packed)] = pack_digests([(1, text)])
+    assert ids == [1]
+    assert outbox._text_length(packed) <= MESSAGE_LIMIT
+    assert packed.endswith(outbox.TRUNCATED_SUFFIX)
+    assert not packed.rstrip(outbox.TRUNCATED_SUFFIX).endswith(("&", "&a", "&am", "&amp"))
+
+
+def test_truncate_closes_cut_tag():
+    text = outbox._truncate("<b>" + "я" * 5000 + "</b>")
+    assert text.endswith("</b>")
+    assert outbox._text_length(text) <= MESSAGE_LIMIT
+
+
+def test_rejected_digest_is_split(outbox_db):
+    bot = FakeBot({"bad": bad_request("bad")})
+    notifications = [notification(1, "first"), notification(2, "bad <"), notification(3, "third")]
+    asyncio.run(outbox._process_digest(bot, notifications))
+    assert bot.sent == ["first", "third"]
+    assert sorted(outbox_db["sent"]) == [1, 3]
+    assert outbox_db["failed"] == [2]
+    assert outbox_db["rescheduled"] == []
@@ -0,0 +1,43 @@
+import asyncio
+import collections
+import os
+
+import pytest
+
+import profiler
+
+
+@pytest.fixture
+def quick_samples(monkeypatch):
+    """Сэмплы стеков без ожидания"""
+    monkeypatch.setattr(profiler, "sample_stacks", lambda seconds: collections.Counter({"MainThread;main": 3}))
+
+
+def test_second_start_is_rejected_until_first_finishes(quick_samples):
+    async def scenario():
+        first = profiler.start(1)
+        with pytest.raises(RuntimeError):
+            profiler.start(1)
+        path = await first
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+        finally:
+            os.remove(path)
+        return content, profiler.is_running()
+
+    content, running = asyncio.run(scenario())
+    assert content == "MainThread;main 3\n"
+    assert not running
+
+
+def test_concurrent_profile_calls_run_once(quick_samples):
+    async def scenario():
+        return await asyncio.gather(profiler.profile(1), profiler.profile(1), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    paths = [result for result in results if isinstance(result, str)]
+    for path in paths:
+        os.remove(path)
+    assert len(paths) == 1
+    assert sum(isinstance(result, RuntimeError) for result in results) == 1
@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+
+from aiogram.types import Chat, Message, User
+
+from throttling import SlidingWindowLimiter, ThrottlingMiddleware
+
+
+def test_allows_up_to_limit_within_window():
+    limiter = SlidingWindowLimiter(100, 10)
+    assert [limiter.allow("u", 3, 10, now) for now in (0, 1, 2, 3)] == [True, True, True, False]
+
+
+def test_window_slides():
+    limiter = SlidingWindowLimiter(100, 10)
+    for now in (0, 1, 2):
+        limiter.allow("u", 3, 10, now)
+    assert not limiter.allow("u", 3, 10, 9.9)
+    # Событие в момент 0 вышло из окна — освободилось ровно одно место
+    assert limiter.allow("u", 3, 10, 10)
+    assert not limiter.allow("u", 3, 10, 10.5)
+
+
+def test_rejected_events_do_not_extend_window():
+    limiter = SlidingWindowLimiter(100, 10)
+    limiter.allow("u", 1, 10, 0)
+    for now in range(1, 10):
+        assert not limiter.allow("u", 1, 10, now)
+    assert limiter.allow("u", 1, 10, 10)
+
+
+def test_keys_are_independent():
+    limiter = SlidingWindowLimiter(100, 10)
+    assert limiter.allow("a", 1, 10, 0)
+    assert limiter.allow("b", 1, 10, 0)
+    assert not limiter.allow("a", 1, 10, 1)
+
+
+def test_state_is_bounded_by_maxsize():
+    limiter = SlidingWindowLimiter(2, 10)
+    for key in ("a", "b", "c"):
+        limiter.allow(key, 1, 10, 0)
+    assert len(limiter._hits) == 2
+    # Вытесненный ключ начинает с чистого окна
+    assert limiter.allow("a", 1, 10, 1)
+
+
+def test_middleware_drops_flood_and_applies_handler_limit():
+    user = User(id=42, is_bot=False, first_name="Иван")
+
+    def message(text):
+        return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=42, type="private"),
+                       from_user=user, text=text)
+
+    async def handler(event, data):
+        return "handled"
+
+    async def scenario():
+        middleware = ThrottlingMiddleware(rate=5, window=10, limits={"/start": (2, 10)})
+        starts = [await middleware(handler, message("/start payload"), {"event_from_user": user}) for _ in range(3)]
+        others = [await middleware(handler, message("привет"), {"event_from_user": user}) for _ in range(3)]
+        return starts, others
+
+    starts, others = asyncio.run(scenario())
+    assert starts == ["handled", "handled", None]
+    # Общий лимит 5 за 10 секунд: три /start уже засчитаны
+    assert others == ["handled", "handled", None]
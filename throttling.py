@@ -0,0 +1,102 @@
+import collections
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+import metrics
+from cache import MISSING, TTLCache
+import tenants
+from config import METRICS_ENABLED, THROTTLE_CACHE_SIZE, THROTTLE_RATE, THROTTLE_WINDOW
+
+# Отдельные лимиты для дорогих действий: текст кнопки или команда → (сообщений, за секунд).
+# Остальные обновления пользователя ограничены общим лимитом THROTTLE_RATE за THROTTLE_WINDOW
+HANDLER_LIMITS: Dict[str, Tuple[int, float]] = {
+    "/start": (3, 10.0),
+    "📊 Получить расчёт": (3, 10.0),
+    "📞 Получить услугу": (3, 10.0),
+    "📘 3 ошибки селлера": (2, 10.0),
+    "📗 Как выйти на маркетплейсы в 2025": (2, 10.0),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowLimiter:
+    """Скользящее окно по ключу: времена последних разрешённых событий в LRU-кэше ограниченного размера"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # Запись живёт не дольше самого длинного окна — потом она уже ничего не ограничивает
+        self._hits = TTLCache(maxsize, ttl)
+
+    def allow(self, key: Hashable, limit: int, window: float, now: float) -> bool:
+        hits = self._hits.get(key, count=False)
+        if hits is MISSING:
+            hits = collections.deque(maxlen=limit)
+        while hits and now - hits[0] >= window:
+            hits.popleft()
+        if len(hits) >= limit:
+            return False
+        hits.append(now)
+        self._hits.set(key, hits)
+        return True
+
+
+def _limit_key(event: TelegramObject) -> Optional[str]:
+    """Ключ лимита: команда без аргументов, текст кнопки или callback_data"""
+    if isinstance(event, CallbackQuery):
+        return event.data
+    if isinstance(event, Message) and event.text:
+        if event.text.startswith("/"):
+            return event.text.split(maxsplit=1)[0]
+        return event.text
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware роутера: лишние обновления пользователя отбрасываются до фильтров и обработчиков"""
+
+    def __init__(self, rate: int = THROTTLE_RATE, window: float = THROTTLE_WINDOW,
+                 limits: Optional[Dict[str, Tuple[int, float]]] = None, cache_size: int = THROTTLE_CACHE_SIZE):
+        self.rate = rate
+        self.window = window
+        self.limits = HANDLER_LIMITS if limits is None else limits
+        longest = max([window, *(limit_window for _, limit_window in self.limits.values())])
+        self.limiter = SlidingWindowLimiter(cache_size, longest)
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        tenant = tenants.current()
+        if user is None or user.id == tenant.admin_id:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        key = _limit_key(event)
+        # Лимитер общий для всех ботов процесса, поэтому ключи содержат имя бота
+        user_key = (tenant.name, user.id)
+        if not self.limiter.allow(user_key, self.rate, self.window, now):
+            return await self._drop(event, user.id, "default")
+        if key in self.limits:
+            limit, window = self.limits[key]
+            if not self.limiter.allow((user_key, key), limit, window, now):
+                return await self._drop(event, user.id, key)
+        return await handler(event, data)
+
+    async def _drop(self, event: TelegramObject, user_id: int, key: str):
+        logger.debug("Пропущено обновление пользователя %s (лимит %s)", user_id, key)
+        if METRICS_ENABLED:
+            metrics.THROTTLED.inc(key)
+        # Иначе у пользователя будут «крутиться часики» на кнопке
+        if isinstance(event, CallbackQuery):
+            await event.answer()
+
+
+def setup(router: Router):
+    if THROTTLE_RATE <= 0:
+        return
+    middleware = ThrottlingMiddleware()
+    router.message.outer_middleware(middleware)
+    router.callback_query.outer_middleware(middleware)
@@ -0,0 +1,95 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import TelegramObject, User
+
+import analytics
+import database as db
+import outbox
+from admin import format_lead
+
+
+class UserContext:
+    """Пользователь текущего обновления: строка читается из базы один раз, изменения записываются в конце"""
+
+    def __init__(self, user: User, row: Optional[dict]):
+        self.user_id = user.id
+        self.registered = row is not None
+        self.username = row['username'] if row else user.username
+        self.first_name = row['first_name'] if row else user.first_name
+        self.last_name = row['last_name'] if row else user.last_name
+        self.phone_number = row['phone_number'] if row else None
+        self.contact_shared = bool(row['contact_shared']) if row else False
+        self._telegram_user = user
+        self._profile: Optional[Tuple[Optional[str], Optional[str], Optional[str]]] = None
+        self._phone_changed = False
+        self._leads: List[Tuple[str, dict, str]] = []
+        self._notifications: List[str] = []
+
+    @property
+    def info(self) -> dict:
+        """Данные клиента для текста уведомления, как у db.get_user_info"""
+        return {
+            'username': self.username,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'phone_number': self.phone_number
+        }
+
+    @property
+    def changed(self) -> bool:
+        return bool(self._profile or self._phone_changed or self._leads or self._notifications)
+
+    def register(self):
+        """Регистрация по /start; повторная снова включает пользователя в рассылки"""
+        user = self._telegram_user
+        self._profile = (user.username, user.first_name, user.last_name)
+        self.registered = True
+
+    def share_contact(self, phone_number: str):
+        self.phone_number = phone_number
+        self.contact_shared = True
+        self._phone_changed = True
+
+    def add_lead(self, service_name: str, **fields):
+        """Лид с готовым текстом уведомления: при доставке администратору база уже не читается"""
+        self._leads.append((service_name, fields, format_lead(self.user_id, self.info, service_name, **fields)))
+        analytics.track(self.user_id, analytics.LEAD, service_name)
+
+    def notify_admin(self, text: str):
+        self._notifications.append(text)
+
+    async def flush(self):
+        """Запись накопленных изменений одной операцией и сигнал отправки уведомлений"""
+        if not self.changed:
+            return
+        profile, phone_number = self._profile, self.phone_number if self._phone_changed else None
+        leads, notifications = self._leads, self._notifications
+        self._profile, self._phone_changed, self._leads, self._notifications = None, False, [], []
+        await db.save_user_changes(self.user_id, profile, phone_number, leads, notifications)
+        if leads or notifications:
+            outbox.wake()
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: UserContext для обработчика в аргументе user и запись изменений после него"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        telegram_user = data.get("event_from_user")
+        if telegram_user is None:
+            return await handler(event, data)
+
+        user = UserContext(telegram_user, await db.get_user(telegram_user.id))
+        data["user"] = user
+        try:
+            return await handler(event, data)
+        finally:
+            # Записываем и при ошибке в обработчике: лид, принятый до неё, не должен потеряться
+            await user.flush()
+
+
+def setup(router: Router):
+    middleware = UserContextMiddleware()
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
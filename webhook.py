@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+)
+from main import create_bots, create_dispatcher, init_databases, prepare_media
+import tenants
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_path(tenant: tenants.Tenant) -> str:
+    """Путь webhook бота; у нескольких ботов — WEBHOOK_PATH/<имя>"""
+    if len(tenants.all_tenants()) == 1:
+        return WEBHOOK_PATH
+    return WEBHOOK_PATH.rstrip("/") + "/" + tenant.name
+
+
+async def set_webhook():
+    """Регистрация webhook в Bot API; выполняется один раз до запуска воркеров"""
+    bots = create_bots()
+    try:
+        for tenant, bot in zip(tenants.all_tenants(), bots):
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip("/") + webhook_path(tenant),
+                secret_token=WEBHOOK_SECRET or None,
+            )
+    finally:
+        # Сессия общая для всех ботов
+        await bots[0].session.close()
+
+
+async def serve(worker_index: int = 0, reuse_port: bool = False):
+    """HTTP-сервер одного воркера; фоновые задачи бота запускает только воркер 0"""
+    tenants.load()
+    await init_databases()
+
+    bots = create_bots()
+    dp = create_dispatcher()
+
+    app = web.Application()
+    for tenant, bot in zip(tenants.all_tenants(), bots):
+        # Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются с 401
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(
+            app, path=webhook_path(tenant))
+    setup_application(app, dp, bots=bots, primary=worker_index == 0, worker_index=worker_index)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=reuse_port)
+    await site.start()
+    logger.info("Воркер %s принимает webhook на %s:%s%s", worker_index, WEBHOOK_HOST, WEBHOOK_PORT,
+                ", ".join(webhook_path(tenant) for tenant in tenants.all_tenants()))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        # Вызывает хуки остановки диспетчера: запись очереди и закрытие базы
+        await runner.cleanup()
+
+
+def _worker(worker_index: int):
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(worker_index, reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+
+
+def run():
+    """Запуск в режиме webhook: один процесс или WEBHOOK_WORKERS процессов на общем порту"""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужно указать WEBHOOK_BASE_URL")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не задан — запросы к webhook не проверяются")
+
+    # Манифест собирается один раз до запуска воркеров, они только читают его
+    tenants.load()
+    prepare_media()
+    asyncio.run(set_webhook())
+
+    if WEBHOOK_WORKERS <= 1:
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # Каждый воркер слушает тот же порт с SO_REUSEPORT, ядро распределяет соединения между ними
+    processes = [
+        multiprocessing.Process(target=_worker, args=(index,), name=f"webhook-{index}")
+        for index in range(WEBHOOK_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+
+    def terminate(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C получают все процессы группы, ждём их корректного завершения
+        for process in processes:
+            process.join()